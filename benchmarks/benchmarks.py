@@ -0,0 +1,177 @@
+"""Benchmarks for QINCM, run with asv (https://asv.readthedocs.io)
+
+    asv run                     # benchmark the current commit
+    asv continuous master HEAD  # compare two commits, reports regressions
+    asv dev -b Model            # quick run of a subset, in the current environment
+
+Startup benchmarks time a fresh interpreter for the command line. Model benchmarks run on the models in data/. Synthetic benchmarks run on networks made by qincm.synthetic, to track
+how the model scales with the number of knelpunten, routes and days.
+"""
+
+from pathlib import Path
+import numpy as np
+
+from qincm.qincm import QINCM
+from qincm.synthetic import synthetic_discharges, write_synthetic_network
+
+DATA = Path(__file__).resolve().parents[1] / 'data'
+
+# Reference point of each model
+MODELS = {
+    'testmodel_4p': 'WA_Nijmegen',
+    'testmodel_15p': 'WA_Nijmegen',
+    'application': 'BR_Lobith',
+}
+
+
+def read_model(model):
+    return QINCM(DATA / model / 'route_depth_costs.json', DATA / model / 'knelpunt_discharge_waterdepth.json',
+                 reference=MODELS[model])
+
+
+class Model:
+    params = list(MODELS)
+    param_names = ['model']
+
+    def setup(self, model):
+        self.M = read_model(model)
+
+        # A year of discharges at the reference point, and the same as local discharges per knelpunt
+        Q_ref = self.M.knelpunt_distribution[self.M.knelpunt_reference][0]
+        self.discharges = np.linspace(Q_ref.min(), 1.5 * Q_ref.max(), 365)
+        self.discharges_local = self.M._compute_local_discharge(self.discharges).reset_index(drop=True)
+
+    def _evaluate(self, discharges):
+        return self.M.costs_per_discharge(discharges)
+
+    def time_load(self, model):
+        read_model(model)
+
+    def time_costs_per_discharge_global(self, model):
+        self._evaluate(self.discharges)
+
+    def time_costs_per_discharge_local(self, model):
+        self._evaluate(self.discharges_local)
+
+    def time_costs_for_scenario(self, model):
+        self.M.costs_for_scenario(self.discharges, 1.0)
+
+    def time_stats_knelpunten(self, model):
+        self.M.stats_knelpunten(discharges=self.discharges)
+
+    def peakmem_costs_for_scenario(self, model):
+        self.M.costs_for_scenario(self.discharges, 1.0)
+
+
+class Synthetic:
+    """Synthetic networks with 100 routes per knelpunt"""
+    params = [100, 1000]
+    param_names = ['knelpunten']
+    timeout = 1800
+
+    def setup_cache(self):
+        networks = {}
+        for n in self.params:
+            files = write_synthetic_network(f'synthetic_{n}', n_knelpunten=n, n_routes=100 * n)
+            QINCM(*files, reference='K00000').save(f'synthetic_{n}/model')
+            networks[n] = files
+        return networks
+
+    def setup(self, networks, n):
+        self.files = networks[n]
+        self.M = QINCM.load(f'synthetic_{n}/model')
+        self.discharges = np.linspace(600, 9000, 365)
+
+    def time_load_json(self, networks, n):
+        QINCM(*self.files, reference='K00000')
+
+    def time_load_binary(self, networks, n):
+        QINCM.load(f'synthetic_{n}/model')
+
+    def time_costs_per_discharge(self, networks, n):
+        self.M.costs_per_discharge(self.discharges)
+
+    def peakmem_costs_per_discharge(self, networks, n):
+        self.M.costs_per_discharge(self.discharges)
+
+    def time_costs_for_scenario(self, networks, n):
+        # Fused kernel when numba is installed
+        self.M.costs_for_scenario(self.discharges, 1.0)
+
+    def peakmem_costs_for_scenario(self, networks, n):
+        self.M.costs_for_scenario(self.discharges, 1.0)
+
+    def time_stats_knelpunten(self, networks, n):
+        self.M.stats_knelpunten(n=20)
+
+
+class Workers:
+    """Scaling with the number of threads, on a synthetic network of 1,000 knelpunten and 100,000 routes"""
+    params = [1, 2, 4, 8, 16, 32]
+    param_names = ['workers']
+    timeout = 1800
+
+    def setup_cache(self):
+        files = write_synthetic_network('synthetic_workers', n_knelpunten=1000, n_routes=100000)
+        QINCM(*files, reference='K00000').save('synthetic_workers/model')
+
+    def setup(self, workers):
+        self.M = QINCM.load('synthetic_workers/model')
+        self.discharges = np.linspace(600, 9000, 365)
+
+    def time_costs_per_discharge(self, workers):
+        self.M.costs_per_discharge(self.discharges, workers=workers)
+
+    def time_costs_for_scenario(self, workers):
+        self.M.costs_for_scenario(self.discharges, 1.0, workers=workers)
+
+    def time_stats_knelpunten(self, workers):
+        self.M.stats_knelpunten(n=20, workers=workers)
+
+
+class SyntheticSeries:
+    """Long discharge series on a small synthetic network"""
+    params = [10000, 1000000]
+    param_names = ['days']
+    timeout = 1800
+
+    def setup_cache(self):
+        files = write_synthetic_network('synthetic_series', n_knelpunten=100, n_routes=1000)
+        for n in self.params:
+            synthetic_discharges(n).to_frame().to_csv(f'discharges_{n}.csv')
+        return files
+
+    def setup(self, files, n):
+        self.M = QINCM(*files, reference='K00000')
+
+    def time_costs_for_file(self, files, n):
+        self.M.costs_for_file(f'discharges_{n}.csv', column='Q', chunksize=50000)
+
+    def peakmem_costs_for_file(self, files, n):
+        self.M.costs_for_file(f'discharges_{n}.csv', column='Q', chunksize=50000)
+
+
+class Startup:
+    """Start of a new process, as for every call of the command line"""
+
+    def timeraw_import_qincm(self):
+        return 'import qincm'
+
+    def timeraw_import_model(self):
+        return 'from qincm import QINCM'
+
+    def timeraw_cli_help(self):
+        return """
+        from click.testing import CliRunner
+        from qincm import cli
+        CliRunner().invoke(cli.main, ['--help'])
+        """
+
+    def timeraw_cli_invalid_config(self):
+        return """
+        from click.testing import CliRunner
+        from qincm import cli
+        CliRunner().invoke(cli.main, ['--config', '{"discharges": [1000], "occurance": [1], "mode": "scenario", '
+                                      '"route_depth_costs_file": "missing.json", '
+                                      '"knelpunt_discharge_depth_file": "missing.json", "reference": "X"}'])
+        """
@@ -4,4 +4,11 @@ __author__ = """Jurjen de Jong"""
 __email__ = 'jurjen.dejong@deltares.nl'
 __version__ = '0.2.0'
 
-from .qincm import QINCM
\ No newline at end of file
+
+
+def __getattr__(name):
+    # Import the model (numpy, pandas, scipy) on first use, so the command line starts fast
+    if name == 'QINCM':
+        from .qincm import QINCM
+        return QINCM
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
\ No newline at end of file
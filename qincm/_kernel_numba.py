@@ -0,0 +1,84 @@
+"""Compiled kernels of qincm.kernel. Importing this module requires numba."""
+
+import numba
+import numpy as np
+
+from .engine import NO_LIMIT_DEPTH
+
+
+@numba.njit(cache=True, nogil=True)
+def interp_extrapolate(x, xp, fp, start, end):
+    """engine.interp_extrapolate() for a single value on xp[start:end]"""
+    lo = start
+    hi = end
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if xp[mid] < x:
+            lo = mid + 1
+        else:
+            hi = mid
+    hi = min(max(lo, start + 1), end - 1)
+    lo = hi - 1
+    slope = (fp[hi] - fp[lo]) / (xp[hi] - xp[lo])
+    return slope * (x - xp[lo]) + fp[lo]
+
+
+@numba.njit(cache=True, nogil=True)
+def scenario_totals(discharges, local, distribution, relation, members, first_route, end_route, grid, values, slopes,
+                    ukc, weights, offset, totals):
+    """See kernel.scenario_totals(), adds the routes first_route to end_route to totals"""
+    dist_x, dist_y, dist_offsets = distribution
+    rel_x, rel_y, rel_offsets = relation
+    n_knelpunten = len(rel_offsets) - 1
+    n_routes, n_members = members.shape
+    n_grid = len(grid)
+    n_metrics = len(values) // n_routes
+
+    # Position in the grid of the draught at each knelpunt, the last one for routes without limiting knelpunt
+    j = np.empty(n_knelpunten + 1, dtype=np.int64)
+    dx = np.empty(n_knelpunten + 1)
+    depth = np.empty(n_knelpunten + 1)
+    depth[n_knelpunten] = np.inf
+
+    for i in range(len(discharges)):
+        for k in range(n_knelpunten + 1):
+            if k < n_knelpunten:
+                if local:
+                    q = discharges[i, k]
+                else:
+                    q = interp_extrapolate(discharges[i, 0], dist_x, dist_y, dist_offsets[k], dist_offsets[k + 1])
+                d = interp_extrapolate(q, rel_x, rel_y, rel_offsets[k], rel_offsets[k + 1])
+                depth[k] = np.inf if np.isnan(d) else d
+                draught = d - ukc
+            else:
+                draught = NO_LIMIT_DEPTH - ukc
+
+            # RouteTable.locate()
+            lo = 0
+            hi = n_grid
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if grid[mid] <= draught:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            j[k] = min(max(lo - 1, 0), n_grid - 1)
+            if draught < grid[0] or draught >= grid[n_grid - 1]:
+                dx[k] = 0.0
+            else:
+                dx[k] = draught - grid[j[k]]
+
+        w = weights[i]
+        for r in range(first_route, end_route):
+            # Limiting knelpunt, the first one in case of a tie
+            limit = members[r, 0]
+            for m in range(1, n_members):
+                if depth[members[r, m]] < depth[limit]:
+                    limit = members[r, m]
+            if depth[limit] == np.inf:
+                limit = n_knelpunten
+
+            for metric in range(n_metrics):
+                row = metric * n_routes + r
+                costs = slopes[row, j[limit]] * dx[limit] + values[row, j[limit]]
+                totals[row] += w * (costs - offset[row])
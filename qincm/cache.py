@@ -0,0 +1,66 @@
+"""Result caching.
+
+A bounded least-recently-used cache and helpers to build hashable keys from models and discharge input.
+"""
+
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(*items) -> str:
+    """
+    Hash of a collection of arrays, strings and numbers
+
+    Arrays are hashed on dtype, shape and data, so equal inputs always give the same fingerprint.
+    """
+    h = hashlib.sha1()
+    for item in items:
+        if isinstance(item, (pd.Series, pd.DataFrame, pd.Index)):
+            h.update(fingerprint(item.values, [str(i) for i in item.index]).encode())
+            if isinstance(item, pd.DataFrame):
+                h.update(fingerprint([str(c) for c in item.columns]).encode())
+            continue
+
+        a = np.asarray(item)
+        if a.dtype == object:
+            a = np.asarray([str(i) for i in a.ravel()])
+        h.update(str((a.dtype.str, a.shape)).encode())
+        h.update(np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+
+
+class LRUCache:
+    """
+    Dictionary with a maximum number of items. When full, the least recently used item is removed.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        if key in self._data:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def __getitem__(self, key):
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
@@ -1,26 +1,44 @@
-"""Console script for qincm."""
+"""Console script for qincm.
+
+The model (numpy, pandas, scipy) is only imported when it is needed, so e.g. --help and invalid configurations return
+fast.
+"""
 import sys
 import click
-from qincm.qincm import QINCM
 import logging
 import json
 from pathlib import Path
 
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                    datefmt='%H:%M:%S')
-
 logger = logging.getLogger(__name__)
 
-@click.command()
+
+def _setup_logging(level: str):
+    # Log to the stderr of the process, also when sys.stderr is redirected (e.g. by click's CliRunner)
+    logging.basicConfig(level=getattr(logging, level.upper()), stream=sys.__stderr__,
+                        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%H:%M:%S')
+
+
+@click.group(invoke_without_command=True)
 @click.option('--config', default=None, help="Load a configuration json file or give a json string with all configuration")
 @click.option('--route_depth_costs_file', default="data/testmodel_4p/route_depth_costs.json", help='input file of costs per route')
 @click.option('--knelpunt_discharge_depth_file', default="data/testmodel_4p/knelpunt_discharge_waterdepth.json", help='input file (or json string) of discharge depth relations')
 @click.option('--reference', default="WA_Nijmegen", help='Name of reference point for global mode')
+@click.option('--model', default=None, help='Load a model saved with QINCM.save() instead of the input files')
 @click.option('--mode', default="scenario", help="Type of data input (only [scenario] is implemented)")
 @click.option('--discharges', default=None, help="Required if config not given")
 @click.option('--occurance', default=None, help="Required if config not given")
-def main(config, route_depth_costs_file, knelpunt_discharge_depth_file, reference, mode, discharges, occurance):
+@click.option('--profile', default=None, help="Write a json report with time and memory per stage to this file")
+@click.option('--output', default=None, help="Write the results to a parquet (.parquet) or arrow (.arrow) file instead of json")
+@click.option('--per_discharge', is_flag=True, default=False, help="With --output, write a row per discharge and route")
+@click.option('--log_level', default="INFO", type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR'], case_sensitive=False),
+              help="Level of the log messages (written to stderr)")
+@click.pass_context
+def main(ctx, config, route_depth_costs_file, knelpunt_discharge_depth_file, reference, model, mode, discharges,
+         occurance, profile, output, per_discharge, log_level):
+    _setup_logging(log_level)
+    if ctx.invoked_subcommand is not None:
+        return
 
     file_mode = False  # Output to file or return code
 
@@ -41,16 +59,21 @@ def main(config, route_depth_costs_file, knelpunt_discharge_depth_file, referenc
 
         logger.debug(input_data)
 
-        route_depth_costs_file = Path(input_data["route_depth_costs_file"])
-        knelpunt_discharge_depth_file = Path(input_data["knelpunt_discharge_depth_file"])
+        model = input_data.get("model")
+        if model is None:
+            route_depth_costs_file = Path(input_data["route_depth_costs_file"])
+            knelpunt_discharge_depth_file = Path(input_data["knelpunt_discharge_depth_file"])
 
-        assert route_depth_costs_file.exists()
-        assert knelpunt_discharge_depth_file.exists()
+            assert route_depth_costs_file.exists()
+            assert knelpunt_discharge_depth_file.exists()
 
-        reference = input_data["reference"]
+            reference = input_data["reference"]
         mode = input_data["mode"]
         discharges = input_data["discharges"]
         occurance = input_data["occurance"]
+        profile = input_data.get("profile", profile)
+        output = input_data.get("output", output)
+        per_discharge = input_data.get("per_discharge", per_discharge)
     else:
         assert discharges is not None, '[discharges] not given'
         assert occurance is not None, '[occurance] not given'
@@ -58,15 +81,37 @@ def main(config, route_depth_costs_file, knelpunt_discharge_depth_file, referenc
         discharges = json.loads(discharges)
         occurance = json.loads(occurance)
 
+    assert not (per_discharge and any(isinstance(q, (list, dict)) for q in discharges)), \
+        '--per_discharge requires discharges at the reference point, not local discharges per knelpunt'
+
     logger.info('Running configuration')
 
-    M = QINCM(
-        route_depth_costs_file=route_depth_costs_file,
-        knelpunt_discharge_depth_file=knelpunt_discharge_depth_file,
-        reference=reference
-    )
+    from qincm.qincm import QINCM
+    from qincm.profile import Profiler
+    from qincm.worker import format_result
+
+    profiler = Profiler() if profile is not None else None
+
+    if model is not None:
+        M = QINCM.load(model, profile=profiler)
+    else:
+        M = QINCM(
+            route_depth_costs_file=route_depth_costs_file,
+            knelpunt_discharge_depth_file=knelpunt_discharge_depth_file,
+            reference=reference,
+            profile=profiler
+        )
+
+    if output is not None:
+        # Columnar output, written in batches
+        from qincm.output import write_costs
 
-    if mode == 'scenario':
+        assert mode == 'scenario', 'Only [scenario] is implemented'
+        logger.info(f'Writing output: {output}')
+        write_costs(M, output, discharges, occurance, per_discharge=per_discharge)
+        result = None
+
+    elif mode == 'scenario':
         result = M.costs_for_scenario(
             discharges=discharges,
             occurance=occurance
@@ -76,21 +121,42 @@ def main(config, route_depth_costs_file, knelpunt_discharge_depth_file, referenc
         NotImplementedError()
         result = None
 
-    # Make results better readable
-    result_pretty = result.copy()
-    result_pretty.index = [str(i).replace('frozenset(', '').replace(')', '') for i in result_pretty.index]
-    result_pretty = result_pretty.to_json()
+    if result is not None:
+        # Make results better readable
+        result_pretty = format_result(M, result)
 
-    click.echo(result_pretty)
+        click.echo(result_pretty)
 
     # If we read a file, than also output as file
-    if file_mode:
+    if file_mode and result is not None:
         outputfile = str(config).replace('.json', '_output.json')
         with open(outputfile, 'w') as fout:
             fout.write(result_pretty)
 
+    if profiler is not None:
+        logger.info(f'Writing profile: {profile}')
+        with open(profile, 'w') as fout:
+            json.dump(profiler.report(), fout, indent=2)
+
     return result
 
 
+@main.command()
+@click.option('--models', default=8, help="Number of models to keep in memory")
+def batch(models):
+    """Read json line requests from stdin and write a json line result per request to stdout"""
+    from qincm.worker import ModelCache, serve_stream
+    serve_stream(sys.stdin, sys.stdout, ModelCache(models))
+
+
+@main.command()
+@click.option('--socket', 'path', required=True, help="Path of the Unix socket to listen on")
+@click.option('--models', default=8, help="Number of models to keep in memory")
+def serve(path, models):
+    """Handle json line requests on a Unix socket until interrupted"""
+    from qincm.worker import ModelCache, serve_socket
+    serve_socket(path, ModelCache(models))
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
@@ -0,0 +1,328 @@
+"""Array-backed evaluation engine.
+
+The functions in this module operate on plain numpy arrays and reproduce the results of the scipy ``interp1d``
+objects that QINCM originally used, but evaluate all routes and all discharges at once.
+"""
+
+import numpy as np
+
+# Depth assigned to a route without (known) knelpunten, identical to the fillna() value of the reference path
+NO_LIMIT_DEPTH = 999999
+
+
+def as_float(a):
+    """Array of floats. float32 input stays float32, everything else becomes float64"""
+    a = np.asarray(a)
+    return a if a.dtype in (np.float32, np.float64) else a.astype(float)
+
+
+def weighted_sum(values, weights, axis: int = 0, chunksize: int = 65536):
+    """
+    Sum of values * weights along an axis, in float64
+
+    float32 values are converted to float64 in chunks along the axis, so the result is accurate without a float64
+    copy of all values. float64 values are summed at once.
+
+    :param values: array of any shape
+    :param weights: weight per position on the axis, shape (values.shape[axis],)
+    :param axis: axis to sum over
+    :param chunksize: number of positions on the axis converted at once
+    """
+    values = np.moveaxis(np.asarray(values), axis, 0)
+    weights = np.asarray(weights, dtype=float).reshape((-1,) + (1,) * (values.ndim - 1))
+    if values.dtype == np.float64:
+        return (values * weights).sum(axis=0)
+
+    total = np.zeros(values.shape[1:])
+    for start in range(0, len(values), chunksize):
+        chunk = slice(start, start + chunksize)
+        total += (values[chunk].astype(float) * weights[chunk]).sum(axis=0)
+    return total
+
+
+def sort_relation(x, y):
+    """
+    Sort a relation on x, the same way interp1d does
+
+    :param x: x-coordinates
+    :param y: y-coordinates (same length as x)
+    :return: (x, y) as float arrays, sorted on x
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    order = np.argsort(x, kind='mergesort')
+    return x[order], y[order]
+
+
+def interp_extrapolate(x, xp, fp):
+    """
+    Linear interpolation with linear extrapolation outside of xp
+
+    Identical to interp1d(xp, fp, kind='linear', fill_value='extrapolate')
+
+    :param x: values to evaluate, any shape
+    :param xp: sorted x-coordinates, shape (n,)
+    :param fp: y-coordinates, shape (n,)
+    """
+    x = np.asarray(x, dtype=float)
+    lo = (np.searchsorted(xp, x) - 1).clip(0, len(xp) - 2)
+
+    slope = (fp[1:] - fp[:-1]) / (xp[1:] - xp[:-1])
+    return slope[lo] * (x - xp[lo]) + fp[lo]
+
+
+class RouteTable:
+    """
+    Dense table with a value per route (e.g. costs per day) as function of the draught
+
+    Calling the table is identical to np.interp(x, grid, values[r]) for every route r, so constant outside of the
+    grid. Slopes are computed once, so an evaluation is two gathers and a multiply-add per route and discharge.
+    """
+
+    def __init__(self, grid, values, slopes=None, dtype=float):
+        """
+        :param grid: sorted draughts, shared by all routes, shape (G,)
+        :param values: value per route per draught, shape (R, G)
+        :param slopes: optional, precomputed slopes (e.g. memory mapped from a saved model), shape (R, G)
+        :param dtype: float type of the values and of the results (float64 or float32). The grid is always float64.
+        """
+        self.grid = np.asarray(grid, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+
+        # Slope of each segment; the last column is constant extrapolation
+        if slopes is None:
+            slopes = np.diff(self.values, axis=1) / np.diff(self.grid)
+            slopes = np.concatenate([slopes, np.zeros((len(self.values), 1))], axis=1)
+        self.slopes = np.asarray(slopes, dtype=float)
+
+        self.dtype = np.dtype(dtype)
+        if self.dtype != np.float64:
+            self.values = self.values.astype(self.dtype)
+            self.slopes = self.slopes.astype(self.dtype)
+
+    def __len__(self):
+        return len(self.values)
+
+    def take(self, rows):
+        """Table with only the given routes"""
+        return RouteTable(self.grid, self.values[rows], self.slopes[rows], dtype=self.dtype)
+
+    def astype(self, dtype):
+        """Table with values of another float type"""
+        if np.dtype(dtype) == self.dtype:
+            return self
+        return RouteTable(self.grid, self.values, self.slopes, dtype=dtype)
+
+    def locate(self, x):
+        """
+        Segment and offset in the grid for each value in x
+
+        :return: (j, dx) with j the index of the lower grid point and dx the distance to it. Outside the grid dx is 0
+            and j points at the first or last grid point.
+        """
+        x = as_float(x)
+        j = (np.searchsorted(self.grid, x, side='right') - 1).clip(0, len(self.grid) - 1)
+        dx = x - self.grid[j]
+        dx = np.where((x < self.grid[0]) | (x >= self.grid[-1]), 0.0, dx)
+        return j, dx.astype(self.dtype, copy=False)
+
+    def __call__(self, x, index=None):
+        """
+        Evaluate the table
+
+        :param x: draughts, shape (..., R). Column r is evaluated on the row of route r.
+        :param index: optional, shape (..., R). If given, route r is evaluated at x[..., index[..., r]] instead. This
+            allows x to hold only the few distinct draughts (one per knelpunt) that are shared by many routes.
+        :return: array of shape (..., R)
+        """
+        j, dx = self.locate(x)
+        if self.dtype != np.float64 and self.values.size < 2 ** 31:
+            # Compact indices as well
+            j = j.astype(np.int32)
+        if index is not None:
+            j = np.take_along_axis(j, index, axis=-1)
+            dx = np.take_along_axis(dx, index, axis=-1)
+
+        flat = j + np.arange(len(self), dtype=j.dtype) * self.values.shape[1]
+        return self.slopes.ravel()[flat] * dx + self.values.ravel()[flat]
+
+
+def limiting_depth(depths, members):
+    """
+    Minimum depth over the knelpunten of each route
+
+    Missing depths (NaN) are skipped. Routes without any depth get NO_LIMIT_DEPTH.
+
+    :param depths: depth per knelpunt, shape (..., K). float32 depths give float32 results
+    :param members: index of the knelpunten per route, shape (R, L). Padded with K.
+    :return: (r_depth, index). Both of shape (..., R). index is the column in depths of the limiting knelpunt
+        (first one in case of a tie), or K if the route has no depth.
+    """
+    depths = as_float(depths)
+    depths = np.where(np.isnan(depths), np.inf, depths).astype(depths.dtype, copy=False)
+
+    # Knelpunten first, so that selecting a knelpunt for all routes copies contiguous rows
+    depths = np.moveaxis(depths, -1, 0)
+    padding = np.full((1,) + depths.shape[1:], np.inf, dtype=depths.dtype)
+    depths = np.concatenate([depths, padding], axis=0)
+
+    # Walk over the positions on the routes, this is much faster than a reduction over a short last axis
+    r_depth = depths[members[:, 0]]
+    index = np.empty(r_depth.shape, dtype=members.dtype)
+    index[...] = members[:, 0].reshape((-1,) + (1,) * (depths.ndim - 1))
+    for column in members.T[1:]:
+        d = depths[column]
+        closer = d < r_depth
+        np.copyto(r_depth, d, where=closer)
+        np.copyto(index, column.reshape((-1,) + (1,) * (depths.ndim - 1)), where=closer)
+
+    no_limit = np.isinf(r_depth)
+    r_depth[no_limit] = NO_LIMIT_DEPTH
+    index[no_limit] = len(depths) - 1
+    return np.moveaxis(r_depth, 0, -1), np.moveaxis(index, 0, -1)
+
+
+def route_costs(table, depths, members, ukc: float, out=None, blocksize: int = 2 ** 18):
+    """
+    Value of the table for each route at the draught of its limiting knelpunt
+
+    Identical to table(with_no_limit(depths) - ukc, index=limiting_depth(depths, members)[1]) for all metrics, but
+    computed route-major: the depths are ranked per discharge, the smallest rank over the knelpunten of every route
+    gives the segment and offset of its draught, and the table is evaluated for all routes of a block of discharges
+    at once. Blocks are small enough to stay in the cache, and the result is written in the order pandas stores a
+    DataFrame, so it is transposed only once.
+
+    :param table: RouteTable with M * R rows, R routes for each of M metrics
+    :param depths: depth per knelpunt, shape (..., K). Missing depths (NaN) are skipped.
+    :param members: index of the knelpunten per route, shape (R, L). Padded with K.
+    :param ukc: under keel clearance, subtracted from the depth to get the draught
+    :param out: optional array of shape (N, M * R) for the result, with N the number of depths
+    :param blocksize: number of routes times discharges in a block
+    :return: array of shape (..., M * R). Without out it is a view of a route-major array (Fortran order).
+    """
+    depths = as_float(depths)
+    shape = depths.shape[:-1]
+    depths = depths.reshape(-1, depths.shape[-1]).T
+    (K, N), R = depths.shape, len(members)
+    if out is None:
+        out = np.empty((len(table), N), dtype=table.dtype).T
+    if members.shape[1] == 0:
+        members = np.full((R, 1), K, dtype=members.dtype)
+
+    # Depths by rank from small to large per discharge, missing depths (NaN) last, and K (no limit) after them. The
+    # draughts are the same as with_no_limit(depths) - ukc, missing depths are not limiting.
+    order = np.concatenate([np.argsort(depths, axis=0), np.full((1, N), K)])
+    draughts = np.concatenate([np.take_along_axis(depths, order[:K], axis=0),
+                               np.full((1, N), NO_LIMIT_DEPTH, dtype=depths.dtype)])
+    draughts[np.isnan(draughts)] = NO_LIMIT_DEPTH
+    draughts -= ukc
+    j, dx = table.locate(draughts)
+    rank = np.empty((K + 1, N), dtype=np.int32 if (K + 1) * N < 2 ** 31 else np.intp)
+    np.put_along_axis(rank, order, np.arange(K + 1, dtype=rank.dtype)[:, np.newaxis], axis=0)
+
+    # Longest routes first, so that the routes with a knelpunt at position c on the route are the first counts[c]
+    lengths = (members < K).sum(axis=1)
+    route_order = np.argsort(-lengths, kind='stable')
+    restore = np.argsort(route_order)
+    members = members[route_order]
+    counts = [np.count_nonzero(lengths > c) for c in range(members.shape[1])]
+    rows = np.arange(R)[:, np.newaxis] * table.values.shape[1]
+
+    size = max(16, blocksize // max(R, 1))
+    for start in range(0, N, size):
+        block = slice(start, start + size)
+        n = len(range(*block.indices(N)))
+
+        # Smallest rank on each route, as position in the (K + 1, n) arrays of the block
+        keys = rank[:, block] * rank.dtype.type(n) + np.arange(n, dtype=rank.dtype)
+        limiting = keys[members[:, 0]]
+        for c in range(1, members.shape[1]):
+            np.minimum(limiting[:counts[c]], keys[members[:counts[c], c]], out=limiting[:counts[c]])
+        limiting = limiting[restore].astype(np.intp, copy=False)
+
+        flat = j[:, block].ravel().take(limiting)
+        flat += rows
+        dx_route = dx[:, block].ravel().take(limiting)
+        for m in range(len(table) // max(R, 1)):
+            if m > 0:
+                flat += R * table.values.shape[1]
+            costs = out[block, m * R:(m + 1) * R].T
+            np.multiply(table.slopes.ravel().take(flat), dx_route, out=costs)
+            costs += table.values.ravel().take(flat)
+    return out.reshape(shape + (len(table),))
+
+
+def with_no_limit(depths):
+    """
+    Append the NO_LIMIT_DEPTH column that index K of limiting_depth() refers to
+
+    :param depths: depth per knelpunt, shape (..., K)
+    :return: array of shape (..., K + 1)
+    """
+    depths = as_float(depths)
+    padding = np.full(depths.shape[:-1] + (1,), NO_LIMIT_DEPTH, dtype=depths.dtype)
+    return np.concatenate([depths, padding], axis=-1)
+
+
+def linear_crossings(x, y, levels):
+    """
+    Positions where piecewise linear functions cross given levels
+
+    :param x: sorted nodes, shape (n,)
+    :param y: values at the nodes, shape (n,) or (n, M) for M functions
+    :param levels: values to find, shape (G,)
+    :return: sorted unique positions strictly between two nodes where any of the functions equals any of the levels
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float).reshape(len(x), -1)
+    levels = np.sort(np.asarray(levels, dtype=float).ravel())
+
+    y0, y1 = y[:-1], y[1:]
+    first = np.searchsorted(levels, np.minimum(y0, y1), side='right')
+    count = np.searchsorted(levels, np.maximum(y0, y1), side='left') - first
+    count = np.where(np.isnan(y0) | np.isnan(y1), 0, count).clip(0)
+
+    # One entry per (segment, function, level) combination that crosses
+    segment, function = np.nonzero(count)
+    n = count[segment, function]
+    segment = np.repeat(segment, n)
+    function = np.repeat(function, n)
+    start = np.cumsum(n) - n
+    level = np.repeat(first[np.nonzero(count)] - start, n) + np.arange(n.sum())
+
+    t = (levels[level] - y0[segment, function]) / (y1[segment, function] - y0[segment, function])
+    return np.unique(x[segment] + t * (x[segment + 1] - x[segment]))
+
+
+class ResponseSurface(RouteTable):
+    """
+    Costs per route tabulated as function of the discharge at the reference point
+
+    The table is exact at all its nodes and linear in between, like the model itself when the nodes include all
+    breakpoints of the model.
+    """
+
+    def __init__(self, discharges, values, ukc):
+        """
+        :param discharges: sorted discharges at the reference point, shape (n,)
+        :param values: costs per route per discharge, shape (R, n)
+        :param ukc: under keel clearance used to compute the values
+        """
+        super().__init__(discharges, values)
+        self.ukc = ukc
+
+    def covers(self, discharges) -> bool:
+        """True if all discharges are within the range of the table"""
+        discharges = np.asarray(discharges, dtype=float)
+        return bool(np.all((discharges >= self.grid[0]) & (discharges <= self.grid[-1])))
+
+    def evaluate(self, discharges):
+        """
+        Costs for all routes
+
+        :param discharges: discharges at the reference point, shape (N,)
+        :return: array of shape (N, R)
+        """
+        j, dx = self.locate(discharges)
+        flat = j[:, np.newaxis] + np.arange(len(self)) * self.values.shape[1]
+        return self.slopes.ravel()[flat] * dx[:, np.newaxis] + self.values.ravel()[flat]
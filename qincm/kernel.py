@@ -0,0 +1,73 @@
+"""Fused evaluation kernel, compiled with numba.
+
+The array engine computes the local discharge, depth and costs for all discharges at once, which creates arrays of
+(discharges x knelpunten) and (discharges x routes). For totals over a scenario, the kernel in this module computes
+the whole chain per discharge and adds the weighted costs to the totals directly: local discharge, depth, limiting
+knelpunt per route and costs per route, without intermediate arrays.
+
+numba is optional. It is imported and the kernel is compiled (and cached on disk) on first use; available() tells
+whether that is possible. Without numba QINCM uses the array engine.
+"""
+
+import numpy as np
+
+from . import parallel as _parallel
+
+
+def available() -> bool:
+    """True if numba is installed"""
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def pack_relations(relations):
+    """
+    Concatenate relations (x, y) of different length
+
+    :param relations: list of (x, y), x sorted
+    :return: (x, y, offsets), relation i is x[offsets[i]:offsets[i + 1]]
+    """
+    offsets = np.zeros(len(relations) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(x) for x, _ in relations])
+    x = np.concatenate([np.asarray(x, dtype=float) for x, _ in relations]) if relations else np.zeros(0)
+    y = np.concatenate([np.asarray(y, dtype=float) for _, y in relations]) if relations else np.zeros(0)
+    return x, y, offsets
+
+
+def scenario_totals(discharges, local: bool, distribution, relation, members, table, ukc: float, weights, offset,
+                    workers: int = 1):
+    """
+    Weighted sum of the costs per route over all discharges
+
+    :param discharges: discharges at the reference point, shape (N,), or local discharges, shape (N, K)
+    :param local: True for local discharges
+    :param distribution: packed (Q_ref, Q) relations per knelpunt, see pack_relations(). Not used for local discharges.
+    :param relation: packed (Q, D) relations per knelpunt
+    :param members: knelpunten per route, shape (R, L), padded with K
+    :param table: RouteTable with the costs, R routes for each metric
+    :param ukc: under keel clearance
+    :param weights: weight (occurance) per discharge, shape (N,)
+    :param offset: subtracted from the costs per row of the table, e.g. the costs without limitations
+    :param workers: number of threads, each sums all discharges for a block of routes. Since every total is summed by
+        one thread in the order of the discharges, the totals do not depend on the number of workers.
+    :return: float64 totals per row of the table
+    """
+    try:
+        from ._kernel_numba import scenario_totals as kernel
+    except ImportError:
+        raise ImportError('The fused kernel requires numba')
+    discharges = np.ascontiguousarray(np.asarray(discharges, dtype=float).reshape(len(weights), -1))
+    members = np.ascontiguousarray(members, dtype=np.int64)
+    weights = np.asarray(weights, dtype=float)
+    offset = np.asarray(offset, dtype=float)
+    totals = np.zeros(len(table))
+
+    def run(block):
+        kernel(discharges, local, distribution, relation, members, block.start, block.stop, table.grid, table.values,
+               table.slopes, float(ukc), weights, offset, totals)
+
+    _parallel.map_blocks(run, _parallel.split(len(members), workers, min_size=256), workers)
+    return totals
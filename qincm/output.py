@@ -0,0 +1,109 @@
+"""Columnar output (Parquet and Arrow IPC files).
+
+Routes are written as list-typed columns with the names of their knelpunten, so no route names have to be parsed
+from strings. Costs per discharge are written in batches, so they never have to be in memory at once. Requires
+pyarrow, which is only imported when such a file is written.
+"""
+
+from pathlib import Path
+from typing import Union
+import numpy as np
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('Writing parquet or arrow files requires pyarrow')
+    return pa
+
+
+class _Writer:
+    """Write record batches to a parquet file (.parquet, .pq) or Arrow IPC file (.arrow, .feather, .ipc)"""
+
+    def __init__(self, path, schema):
+        pa = _pyarrow()
+        suffix = Path(path).suffix.lower()
+        if suffix in ('.parquet', '.pq'):
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, schema)
+        elif suffix in ('.arrow', '.feather', '.ipc'):
+            self._writer = pa.ipc.new_file(path, schema)
+        else:
+            raise ValueError(f'Unknown file type: {suffix}')
+
+    def write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+
+
+def _route_columns(M):
+    """Arrays with the route (list of knelpunten) and metric of every column of the output of M"""
+    pa = _pyarrow()
+    routes = pa.array([[M.route_index.knelpunten[k] for k in ids] for ids in M.route_index.route_ids],
+                      type=pa.list_(pa.string()))
+    n_metrics = 1 if M.metrics is None else len(M.metrics)
+    route = np.tile(np.arange(len(routes)), n_metrics)
+    metric = np.repeat(np.arange(n_metrics), len(routes))
+    return routes, route, metric
+
+
+def _schema(M, per_discharge: bool):
+    pa = _pyarrow()
+    fields = [('discharge', pa.float64()), ('occurance', pa.float64())] if per_discharge else []
+    fields.append(('route', pa.list_(pa.string())))
+    if M.metrics is not None:
+        fields.append(('metric', pa.dictionary(pa.int32(), pa.string())))
+    fields.append(('costs', pa.float64()))
+    return pa.schema(fields)
+
+
+def write_costs(M, path: Union[str, Path], discharges, occurance=None, delta: bool = True,
+                per_discharge: bool = False, chunksize: int = 10000):
+    """
+    Write the results of a scenario as a table with a row per route (and metric)
+
+    :param M: QINCM model
+    :param path: parquet (.parquet, .pq) or Arrow IPC (.arrow, .feather, .ipc) file
+    :param discharges: list of discharges at the reference point
+    :param occurance: float, or list with for each discharge the number of days. If none, every discharge occurs one day
+    :param delta: subtract the costs without limitations, like in costs_for_scenario
+    :param per_discharge: write a row per discharge and route with the costs per day and the occurance, instead of
+        the total costs per route. Requires discharges at the reference point.
+    :param chunksize: number of discharges per batch (per_discharge)
+    """
+    if per_discharge and np.ndim(discharges) != 1:
+        raise ValueError('per_discharge requires discharges at the reference point, not local discharges per knelpunt')
+    pa = _pyarrow()
+    routes, route, metric = _route_columns(M)
+    schema = _schema(M, per_discharge)
+
+    def batch(costs, discharge=None, weight=None):
+        n = len(costs) // len(route)
+        columns = [] if discharge is None else [pa.array(np.repeat(discharge, len(route))),
+                                                pa.array(np.repeat(weight, len(route)))]
+        columns.append(routes.take(pa.array(np.tile(route, n))))
+        if M.metrics is not None:
+            columns.append(pa.DictionaryArray.from_arrays(pa.array(np.tile(metric, n), type=pa.int32()),
+                                                          pa.array(M.metrics)))
+        columns.append(pa.array(np.asarray(costs, dtype=float)))
+        return pa.record_batch(columns, schema=schema)
+
+    writer = _Writer(path, schema)
+    try:
+        if not per_discharge:
+            writer.write(batch(M.costs_for_scenario(discharges, occurance, delta=delta).values))
+            return
+
+        discharges = np.asarray(discharges, dtype=float)
+        occurance = np.broadcast_to(np.asarray(1.0 if occurance is None else occurance, dtype=float), discharges.shape)
+        for start in range(0, len(discharges), chunksize):
+            chunk = slice(start, start + chunksize)
+            costs = M.costs_per_discharge(discharges[chunk]).values
+            if delta:
+                costs = costs - M.costs_no_problems.values
+            writer.write(batch(costs.ravel(), discharges[chunk], occurance[chunk]))
+    finally:
+        writer.close()
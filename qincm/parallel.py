@@ -0,0 +1,39 @@
+"""Blocks of work on a thread pool.
+
+The numpy operations of the array engine (and the numba kernel) release the GIL, so blocks of discharges or routes
+can run in parallel threads without copying the model. Blocks are split such that every element of the result is
+computed by exactly one block, in the same way as without blocks, so results do not depend on the number of workers.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import numpy as np
+
+
+def n_workers(workers: int = None) -> int:
+    """Number of threads: 1 for None, all cores for -1"""
+    if workers is None:
+        return 1
+    if workers == -1:
+        return os.cpu_count() or 1
+    assert workers >= 1, 'workers should be a positive number, or -1 for all cores'
+    return int(workers)
+
+
+def split(n: int, workers: int, min_size: int = 1) -> list:
+    """
+    Split range(n) in at most workers contiguous blocks of at least min_size (except for n < min_size)
+
+    :return: list of slices, in order
+    """
+    count = max(1, min(workers, n // max(min_size, 1)))
+    bounds = np.linspace(0, n, count + 1).round().astype(int)
+    return [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def map_blocks(func, blocks: list, workers: int) -> list:
+    """Results of func for each block, in the order of the blocks. Runs on a thread pool if workers > 1."""
+    if workers <= 1 or len(blocks) <= 1:
+        return [func(block) for block in blocks]
+    with ThreadPoolExecutor(max_workers=min(workers, len(blocks))) as pool:
+        return list(pool.map(func, blocks))
@@ -0,0 +1,168 @@
+"""Timing and memory per stage of a computation.
+
+A Profiler records wall time, number of calls and peak allocated memory for named stages, e.g. reading the input,
+computing local discharges or interpolating the costs of the routes. QINCM only calls into the profiler when one is
+set, so without a profiler the cost is a single attribute check per stage. The profiler keeps totals over all calls,
+and the stages of the last outermost call separately.
+
+Stages can be nested: time is reported including the inner stages (time) and excluding them (self_time).
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+import tracemalloc
+
+# Python >= 3.9. Before, the traces are cleared instead, see Profiler._reset_peak()
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+class Profiler:
+    """
+    Collect time and memory per stage
+
+    Hooks are called at the end of every stage as hook(stage, seconds, peak_memory), e.g. to forward the timings to a
+    monitoring system. peak_memory is None if memory is not traced.
+    """
+
+    def __init__(self, memory: bool = True, hooks: list = None):
+        """
+        :param memory: trace the peak allocated memory per stage with tracemalloc. This slows down the computation.
+        :param hooks: functions to call at the end of every stage
+        """
+        self.memory = memory
+        self.hooks = list(hooks) if hooks is not None else []
+        self.stages = {}
+        self.last = {}
+        self._stack = []
+        self._started = False
+        self._offset = 0
+
+    def reset(self):
+        """Remove all records"""
+        self.stages = {}
+        self.last = {}
+
+    def _traced_memory(self):
+        """Current and peak traced memory, including the memory of traces cleared by _reset_peak()"""
+        current, peak = tracemalloc.get_traced_memory()
+        return current + self._offset, peak + self._offset
+
+    def _reset_peak(self):
+        """
+        Reset the peak of tracemalloc to the current memory
+
+        Without tracemalloc.reset_peak() (Python < 3.9) the traces are cleared, and the memory they held is kept as
+        an offset. Memory that was allocated before and is freed during a stage is then not subtracted.
+        """
+        if _reset_peak is not None:
+            _reset_peak()
+        else:
+            self._offset += tracemalloc.get_traced_memory()[0]
+            tracemalloc.clear_traces()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the time and memory of the code in this context as stage name"""
+        if not self._stack:
+            self.last = {}
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+                self._offset = 0
+            current, peak = self._traced_memory()
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            self._reset_peak()
+        else:
+            current = 0
+        frame = {'start_memory': current, 'peak': current, 'inner': 0.0}
+        self._stack.append(frame)
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            self._stack.pop()
+
+            peak = None
+            if self.memory:
+                peak = max(frame['peak'], self._traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+                self._reset_peak()
+                peak -= frame['start_memory']
+            if self._stack:
+                self._stack[-1]['inner'] += seconds
+
+            for stages in (self.stages, self.last):
+                record = stages.setdefault(name, {'calls': 0, 'time': 0.0, 'self_time': 0.0, 'peak_memory': None})
+                record['calls'] += 1
+                record['time'] += seconds
+                record['self_time'] += seconds - frame['inner']
+                if peak is not None:
+                    record['peak_memory'] = max(record['peak_memory'] or 0, peak)
+
+            if self._started and not self._stack:
+                tracemalloc.stop()
+                self._started = False
+
+            for hook in self.hooks:
+                hook(name, seconds, peak)
+
+    @property
+    def active(self) -> bool:
+        """True while a stage is running"""
+        return len(self._stack) > 0
+
+    def report(self, last: bool = False) -> dict:
+        """
+        Report of the stages, can be written as json
+
+        :param last: only the stages of the last outermost call
+
+        :return: {'stages': {stage: {'calls', 'time', 'self_time', 'peak_memory'}}, 'total_time', 'peak_memory'}.
+            Times in seconds, memory in bytes (None if not traced)
+        """
+        stages = {name: dict(record) for name, record in (self.last if last else self.stages).items()}
+        peaks = [r['peak_memory'] for r in stages.values() if r['peak_memory'] is not None]
+        return {
+            'stages': stages,
+            'total_time': sum(r['self_time'] for r in stages.values()),
+            'peak_memory': max(peaks) if peaks else None,
+        }
+
+
+@contextmanager
+def stage(obj, name: str):
+    """
+    Record the code in this context as stage name on the profiler attribute of obj, if it is set
+
+    At the end of the outermost stage the report of that call is stored as last_profile on obj.
+    """
+    profiler = obj.profiler
+    if profiler is None:
+        yield
+        return
+
+    try:
+        with profiler.stage(name):
+            yield
+    finally:
+        if not profiler.active:
+            obj.last_profile = profiler.report(last=True)
+
+
+def profiled(name: str):
+    """Decorator for methods of objects with a profiler attribute: record the method as stage name"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.profiler is None:
+                return method(self, *args, **kwargs)
+            with stage(self, name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
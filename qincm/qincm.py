@@ -7,34 +7,96 @@ import numpy as np
 from typing import Union, Any, Sequence
 import json
 
+from . import engine as _engine
+from . import kernel as _kernel
+from . import parallel as _parallel
+from .routes import RouteIndex, parse_route_label
+from .cache import LRUCache, fingerprint
+from .stream import read_discharge_chunks
+from . import storage as _storage
+from .profile import Profiler, profiled, stage as _stage
+
+
 class QINCM:
     # Quick Inland Navigation Cost Model
 
     # Under keel clearance
     ukc = 0.20
 
+    # Available evaluation engines: 'array' (vectorized) or 'interp1d' (reference, per route)
+    engines = ('array', 'interp1d')
+
+    # Compute totals with the fused kernel (qincm.kernel) when numba is installed, for scenarios of at least
+    # fused_min_size discharges x routes. Smaller scenarios are not faster, and would pay for importing numba.
+    fused = True
+    fused_min_size = 10_000_000
+
 
     def __init__(self,
                  route_depth_costs_file: Union[str, Path] = None,
                  knelpunt_discharge_depth_file: Union[str, Path] = None,
                  reference: str = None,
+                 engine: str = 'array',
+                 cache_size: int = 0,
+                 profile=None,
+                 dtype=np.float64,
+                 prune: tuple = None,
+                 keep_last: bool = False,
                  ):
         """
         Initialise
 
-        :param route_depth_costs_file:
+        :param route_depth_costs_file: file with the costs per route per depth, or a dict of {metric: file} to
+            evaluate several metrics (e.g. costs, trips, tonnage) on the same routes at once
         :param knelpunt_discharge_depth_file:
         :param reference_point_mode: set True if the discharge in the earlier point links to a single discharge
+        :param engine: 'array' to evaluate all routes at once on dense tables, or 'interp1d' to evaluate each route
+            with its own interpolation function (reference implementation)
+        :param cache_size: number of results of costs_per_discharge to keep in memory (least recently used are
+            removed first). 0 disables the cache.
+        :param profile: True or a Profiler to record time and memory per stage, see last_profile
+        :param dtype: float type of depths, draughts and costs per discharge: np.float64, or np.float32 to halve the
+            memory of large runs. Totals over discharges are always accumulated in float64.
+        :param prune: optional (q_min, q_max), remove knelpunten that can never be limiting for discharges at the
+            reference point in this range from the routes after reading, see prune_routes()
+        :param keep_last: keep the local discharges, depths and costs of the last evaluation of costs_per_discharge
+            (array engine), such that update_knelpunt() only evaluates the routes that pass the changed knelpunt
         """
-
-        # Initialise model
-        self._read_routes_depth_costs(route_depth_costs_file)
-        self._read_knelpunt_discharge_depth(knelpunt_discharge_depth_file, reference=reference)
-
+        assert engine in self.engines, f'Unknown engine: {engine}'
+        self.engine = engine
+        self.dtype = np.dtype(dtype)
+        assert self.dtype in (np.float64, np.float32), f'Unsupported dtype: {dtype}'
+        assert self.dtype == np.float64 or engine == 'array', 'float32 requires the array engine'
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+        self.keep_last = keep_last
+        self._last_evaluation = None
+
+        # Time and memory per stage of the last call, when profiling
+        self.profiler = Profiler() if profile is True else (profile or None)
+        self.last_profile = None
+
+        # Range of discharges at the reference point for which the routes are pruned
+        self.pruned = None
+        self.pruning = None
+
+        # Initialise model. Without input files the model is empty, e.g. to be filled by load()
+        with _stage(self, 'read'):
+            if route_depth_costs_file is not None:
+                self._read_routes_depth_costs(route_depth_costs_file)
+            if knelpunt_discharge_depth_file is not None:
+                self._read_knelpunt_discharge_depth(knelpunt_discharge_depth_file, reference=reference)
+            if prune is not None and route_depth_costs_file is not None and knelpunt_discharge_depth_file is not None:
+                self.prune_routes(*prune)
+
+    @profiled('depth')
     def _compute_knelpunt_depth(self, discharges):
         depths = {}
         for k in self.knelpunt_names:
-            depths[k] = self.knelpunt_discharge_depth[k](discharges[k])
+            if self.engine == 'array':
+                Q, D = self.knelpunt_relations[k]
+                depths[k] = _engine.interp_extrapolate(discharges[k].values, Q, D).astype(self.dtype, copy=False)
+            else:
+                depths[k] = self.knelpunt_discharge_depth[k](discharges[k])
         depths = pd.DataFrame(data=depths, index=discharges.index)
 
         # if isinstance(discharges, pd.DataFrame):
@@ -62,23 +124,82 @@ class QINCM:
 
         depths = self._compute_knelpunt_depth(discharges)
 
+        if self.engine == 'array':
+            costs = self._route_costs(depths.values)
+            return pd.DataFrame(costs, index=discharges.index, columns=self.routes)
+
         # For each r (=FrozenList of knelpunten)
         r_costs = {}
-        for r in self.routes:
+        with _stage(self, 'routes'):
+            for r in self.routes:
 
-            # Get the limiting depth on the route
-            r_depth = depths.reindex(r, axis=1).min(axis=1).fillna(999999)
+                # Get the limiting depth on the route
+                r_depth = depths.reindex(r, axis=1).min(axis=1).fillna(999999)
 
-            # Depth to draught/draft
-            r_draughts = r_depth - self.ukc
+                # Depth to draught/draft
+                r_draughts = r_depth - self.ukc
 
-            # Get costs
-            r_costs[r] = self.routes_depth_costs[r](r_draughts)
+                # Get costs
+                r_costs[r] = self.routes_depth_costs[r](r_draughts)
 
         costs = pd.DataFrame(r_costs, index=discharges.index)
 
         return costs
 
+    @profiled('routes')
+    def _route_costs(self, depths, routes=None, workers: int = 1):
+        """
+        Costs per route from the depth per knelpunt (array engine)
+
+        :param depths: depth per knelpunt, shape (discharges, knelpunten)
+        :param routes: optional, positions of the routes to evaluate. Returns the matching rows of the table as well.
+        :param workers: number of threads, each evaluates a block of discharges (only if routes is None)
+        """
+        # All routes at once, at the draught of their limiting knelpunt
+        if routes is None:
+            if workers > 1 and np.ndim(depths) == 2:
+                costs = np.empty((len(self.route_costs_table), len(depths)), dtype=self.route_costs_table.dtype).T
+
+                def evaluate(block):
+                    _engine.route_costs(self.route_costs_table, depths[block], self.route_members, self.ukc,
+                                        out=costs[block])
+
+                _parallel.map_blocks(evaluate, _parallel.split(len(depths), workers), workers)
+                return costs
+            return _engine.route_costs(self.route_costs_table, depths, self.route_members, self.ukc)
+
+        _, rows = self._metric_columns(np.empty(0), routes)
+        return _engine.route_costs(self.route_costs_table.take(rows), depths, self.route_members[routes], self.ukc), rows
+
+    def _metric_weight(self, metric: str = None):
+        """Weight of every column of the output in a total of one metric: 1 for the columns of metric, 0 otherwise"""
+        if not self.metrics:
+            return np.ones(len(self.routes))
+        metric = self.metrics[0] if metric is None else metric
+        assert metric in self.metrics, f'Unknown metric: {metric}'
+        return np.repeat(np.array(self.metrics) == metric, len(self.route_index)).astype(float)
+
+    def _metric_columns(self, a, routes=None):
+        """
+        Repeat an array over routes (last axis) for each metric, to match the rows of route_costs_table
+
+        :param a: array of shape (..., routes)
+        :param routes: optional, positions of the routes in a. Returns the matching rows of the table as well.
+        """
+        n = 1 if self.metrics is None else len(self.metrics)
+        if routes is None:
+            return np.tile(a, n) if n > 1 else a
+        rows = (np.arange(n)[:, np.newaxis] * len(self.route_index) + routes).ravel()
+        return np.tile(a, n) if n > 1 else a, rows
+
+    def _route_names(self) -> list:
+        """Readable names of the routes (for output)"""
+        names = self.route_index.names()
+        if self.metrics is None:
+            return names
+        return [f'{m}: {n}' for m in self.metrics for n in names]
+
+    @profiled('local_discharge')
     def _compute_local_discharge(self, discharges) -> pd.DataFrame:
         """
         For a given discharge series (global or local) expand and format to local discharge
@@ -87,17 +208,23 @@ class QINCM:
         if np.ndim(discharges) == 1:
             # Only reference discharge is given, compute local discharge from Q-Q-relation
             Q_ref = discharges
+            self._check_pruned(Q_ref)
+
+            # Local discharges
+            Q_local = {}
+            for k in self.knelpunt_names:
+                if self.engine == 'array':
+                    Q_local[k] = _engine.interp_extrapolate(np.asarray(Q_ref, dtype=float), *self.knelpunt_distribution[k])
+                else:
+                    Q_local[k] = self.knelpunt_discharge_distribution[k](Q_ref)
 
             # Initialise DataFrame
             if isinstance(discharges, pd.Series):
-                Q_local = pd.DataFrame(index=discharges.index)
+                Q_local = pd.DataFrame(Q_local, index=discharges.index)
             else:
-                Q_local = pd.DataFrame(index=Q_ref)  # The index is only for convenience.
-
-            # Fill DataFrame with local discharges
-            for k, QQ in self.knelpunt_discharge_distribution.items():
-                Q_local[k] = QQ(Q_ref)
+                Q_local = pd.DataFrame(Q_local, index=Q_ref)  # The index is only for convenience.
         else:
+            assert self.pruned is None, 'Local discharges can not be used when the routes are pruned'
             k_names = self.knelpunt_names
 
             # Reformat DataFarme
@@ -111,27 +238,170 @@ class QINCM:
         return Q_local
 
 
-    def costs_per_discharge(self, discharges) -> pd.DataFrame:
+    def _check_pruned(self, Q_ref):
+        """Assert that the discharges at the reference point are within the range the routes are pruned for"""
+        if self.pruned is not None and len(Q_ref) > 0:
+            assert self.pruned[0] <= np.min(Q_ref) and np.max(Q_ref) <= self.pruned[1], \
+                f'Discharges outside the range the routes are pruned for: {self.pruned}'
+
+    @profiled('costs_per_discharge')
+    def costs_per_discharge(self, discharges, workers: int = None) -> pd.DataFrame:
         """
         Compute total costs per discharge
 
-        param discharges: list of unique discharges. Also supports timeseries
+        param discharges: list of unique discharges. Also supports timeseries, and xarray DataArrays with any
+            dimensions (see _costs_per_discharge_xarray)
+        param workers: number of threads for the array engine (-1 for all cores), each evaluates a block of
+            discharges. The result does not depend on the number of workers. Not used for xarray input.
 
         returns: Series (index=discharges)
         """
-        Q_local = self._compute_local_discharge(discharges)
+        if type(discharges).__module__.startswith('xarray'):
+            return self._costs_per_discharge_xarray(discharges)
+
+        key = None
+        if self.cache is not None:
+            key = (self.fingerprint, self.ukc, fingerprint(discharges))
+            if key in self.cache:
+                return self.cache[key].copy()
+
+        surface = self.global_surface
+        if (surface is not None and np.ndim(discharges) == 1 and surface.ukc == self.ukc
+                and surface.covers(discharges)):
+            # Compiled response surface for the discharge at the reference point
+            index = discharges.index if isinstance(discharges, pd.Series) else discharges
+            with _stage(self, 'surface'):
+                costs = surface.evaluate(np.asarray(discharges, dtype=float)).astype(self.dtype, copy=False)
+            costs = pd.DataFrame(costs, index=index, columns=self.routes)
+        elif self.engine == 'array' and self.keep_last:
+            # Keep depths and costs of the last evaluation, update_knelpunt() updates them in place
+            last_key = (self.ukc, fingerprint(discharges))
+            last = self._last_evaluation
+            if last is None or last['key'] != last_key:
+                Q_local = self._compute_local_discharge(discharges)
+                depths = self._compute_knelpunt_depth(Q_local).to_numpy(dtype=self.dtype, copy=True)
+                last = self._last_evaluation = {
+                    'key': last_key,
+                    'index': Q_local.index,
+                    'discharges': Q_local.to_numpy(dtype=float),
+                    'depths': depths,
+                    'costs': self._route_costs(depths, workers=_parallel.n_workers(workers)),
+                }
+            # A copy, such that changes to the result do not change the kept costs (and the other way around)
+            costs = pd.DataFrame(last['costs'].copy(), index=last['index'], columns=self.routes)
+        elif self.engine == 'array':
+            Q_local = self._compute_local_discharge(discharges)
+            depths = self._compute_knelpunt_depth(Q_local).to_numpy(dtype=self.dtype)
+            costs = pd.DataFrame(self._route_costs(depths, workers=_parallel.n_workers(workers)),
+                                 index=Q_local.index, columns=self.routes, copy=False)
+        else:
+            Q_local = self._compute_local_discharge(discharges)
 
-        costs = self._costs_at_routes_at_discharge(Q_local)
+            costs = self._costs_at_routes_at_discharge(Q_local)
+
+        if key is not None:
+            self.cache[key] = costs.copy()
         return costs
 
+    def _costs_per_discharge_xarray(self, discharges):
+        """
+        Compute costs per route for an xarray DataArray of discharges, e.g. with dimensions time, member and scenario
+
+        Without a 'knelpunt' dimension the values are discharges at the reference point, otherwise local discharges
+        per knelpunt. The result has the dimensions of the input plus 'route' (and 'metric' when several metrics are
+        loaded). If the input is chunked (dask), the result is chunked in the same way and evaluated lazily, chunk by
+        chunk, e.g. when it is written with to_zarr() or to_netcdf(). Missing discharges give missing costs.
+
+        param discharges: xarray.DataArray
 
-    def costs_for_scenario(self, discharges, occurance=None, delta: bool = True):
+        returns: xarray.DataArray named 'costs'
+        """
+        try:
+            import xarray as xr
+        except ImportError:
+            raise ImportError('xarray input requires xarray')
+        assert self.engine == 'array', 'xarray input requires the array engine'
+
+        local = 'knelpunt' in discharges.dims
+        if local:
+            discharges = discharges.sel(knelpunt=self.knelpunt_names)
+            if discharges.chunks is not None:
+                discharges = discharges.chunk({'knelpunt': -1})
+
+        n_metrics = 1 if self.metrics is None else len(self.metrics)
+        output_dims = ['route'] if self.metrics is None else ['metric', 'route']
+
+        def costs_block(Q):
+            shape = Q.shape[:-1] if local else Q.shape
+            Q = Q.reshape(-1, len(self.knelpunt_names)) if local else Q.ravel()
+            missing = np.isnan(Q).any(axis=1) if local else np.isnan(Q)
+
+            depths = self._compute_knelpunt_depth(self._compute_local_discharge(Q)).to_numpy(dtype=self.dtype)
+            costs = self._route_costs(depths)
+            costs[missing] = np.nan
+            return costs.reshape(shape + (n_metrics, -1)[-len(output_dims):])
+
+        costs = xr.apply_ufunc(
+            costs_block, discharges,
+            input_core_dims=[['knelpunt'] if local else []],
+            output_core_dims=[output_dims],
+            dask='parallelized',
+            output_dtypes=[self.dtype],
+            dask_gufunc_kwargs={'output_sizes': dict(zip(output_dims, (n_metrics, len(self.route_index))[-len(output_dims):]))},
+        )
+
+        # Readable route names, so the result can be written to file
+        costs = costs.assign_coords(route=np.array(self.route_index.names(), dtype=object))
+        if self.metrics is not None:
+            costs = costs.assign_coords(metric=self.metrics)
+        return costs.rename('costs')
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Hash of the model input (routes, cost tables and discharge-depth relations)
+        """
+        if self._fingerprint is None:
+            self._fingerprint = self._hash(self.route_costs_table.values)
+        return self._fingerprint
+
+    def _hash(self, route_costs) -> str:
+        """Fingerprint of the model with these cost tables. The tables are hashed as float64, whatever the dtype."""
+        relations = [a for k in self.knelpunt_names for a in self.knelpunt_relations[k] + self.knelpunt_distribution[k]]
+        return fingerprint(
+            self._route_names(),
+            self.route_costs_table.grid,
+            np.asarray(route_costs, dtype=float),
+            self.knelpunt_names,
+            self.knelpunt_reference,
+            *relations,
+        )
+
+
+    @profiled('costs_for_scenario')
+    def costs_for_scenario(self, discharges, occurance=None, delta: bool = True, workers: int = None):
         """
         Compute total costs in scenario
 
         param discharge: list of unique discharges
         param occurance: float, or list with for each discharge the number of days. If none, it assumes every discharges occured one day
+        param workers: number of threads (-1 for all cores). The totals do not depend on the number of workers.
         """
+        total_costs_per_route = self._fused_totals(discharges, occurance, delta, workers=workers)
+        if total_costs_per_route is not None:
+            return total_costs_per_route
+
+        if self.dtype != np.float64:
+            # Accumulate float32 costs in float64, without a float64 copy of all costs
+            costs = self.costs_per_discharge(discharges, workers=workers)
+            weights = pd.Series(1.0, index=costs.index)
+            if occurance is not None:
+                weights = weights.multiply(occurance, axis=0)
+
+            costs = costs.values
+            if delta:
+                costs = costs - self.costs_no_problems.values.astype(self.dtype)
+            return pd.Series(_engine.weighted_sum(costs, weights.values), index=self.routes)
 
         # TODO: Discharge may also be a pandas
         if occurance is not None:
@@ -141,23 +411,21 @@ class QINCM:
             # assert len(discharges) == len(occurance), 'Input should have same length'
 
             # Compute total costs
-            costs = self.costs_per_discharge(discharges)
+            costs = self.costs_per_discharge(discharges, workers=workers)
 
             # Compute delta costs
             if delta:
-                costs_no_problems = self.costs_per_discharge([99999999])  #TODO: This way is not good for depths that are included as constants...
-                costs = costs.subtract(costs_no_problems.values, axis=1)
+                costs = costs.subtract(self.costs_no_problems.values, axis=1)
 
             costs_occurance = costs.multiply(occurance, axis=0)
 
 
         else:
-            costs = self.costs_per_discharge(discharges)
+            costs = self.costs_per_discharge(discharges, workers=workers)
 
 
             if delta:
-                costs_no_problems = self.costs_per_discharge([99999999])
-                costs = costs.subtract(costs_no_problems.values, axis=1)
+                costs = costs.subtract(self.costs_no_problems.values, axis=1)
 
             costs_occurance = costs
 
@@ -168,6 +436,742 @@ class QINCM:
 
         return total_costs_per_route
 
+    def _fused_totals(self, discharges, occurance=None, delta: bool = True, workers: int = None):
+        """
+        Total costs per route with the fused kernel, on blocks of routes if workers > 1
+
+        Returns None if the kernel is not used: the scenario is smaller than fused_min_size, numba is not installed,
+        or the result should come from the interp1d engine, the cache, the global response surface or the last
+        evaluation that is kept for update_knelpunt() (keep_last).
+        """
+        if not (self.fused and self.engine == 'array' and self.cache is None and self.global_surface is None
+                and not self.keep_last):
+            return None
+        if type(discharges).__module__.startswith('xarray') or isinstance(occurance, (pd.Series, pd.DataFrame)):
+            return None
+        if len(discharges) * len(self.route_costs_table) < self.fused_min_size or not _kernel.available():
+            return None
+
+        local = np.ndim(discharges) == 2
+        if local:
+            assert self.pruned is None, 'Local discharges can not be used when the routes are pruned'
+            if isinstance(discharges, pd.DataFrame):
+                discharges = discharges.reindex(columns=self.knelpunt_names)
+            Q = np.asarray(discharges, dtype=float)
+        else:
+            Q = np.asarray(discharges, dtype=float)
+            self._check_pruned(Q)
+
+        weights = np.broadcast_to(np.asarray(1.0 if occurance is None else occurance, dtype=float), (len(Q),))
+        offset = self.costs_no_problems.values if delta else np.zeros(len(self.costs_no_problems))
+        with _stage(self, 'fused'):
+            totals = _kernel.scenario_totals(
+                Q, local,
+                _kernel.pack_relations([self.knelpunt_distribution[k] for k in self.knelpunt_names]),
+                _kernel.pack_relations([self.knelpunt_relations[k] for k in self.knelpunt_names]),
+                self.route_members, self.route_costs_table, self.ukc, weights, offset,
+                workers=_parallel.n_workers(workers))
+        return pd.Series(totals, index=self.routes)
+
+    @profiled('costs_for_file')
+    def costs_for_file(self, discharge_file: Union[str, Path], column: str = None, occurance: float = None,
+                       delta: bool = True, freq: str = None, chunksize: int = 100000,
+                       output_file: Union[str, Path] = None):
+        """
+        Compute total costs for a discharge time series on disk, reading and evaluating it in chunks
+
+        Only totals are kept in memory, so the length of the time series is not limited by the available memory.
+
+        param discharge_file: csv, parquet or netcdf file with a time index and either the discharge at the reference
+            point or a column per knelpunt
+        param column: column with the discharge at the reference point. If None, the columns of the knelpunten are
+            used when available, otherwise the only column in the file
+        param occurance: float, number of days per time step. If none, it assumes every time step is one day
+        param delta: subtract the costs without limitations, like in costs_for_scenario
+        param freq: optional pandas frequency to aggregate the costs per period, e.g. 'Y' or 'M'
+        param chunksize: number of time steps per chunk
+        param output_file: optional csv file to write the costs per time step and route to
+
+        returns: (total_costs_per_route, costs_per_period). costs_per_period is None if freq is not given
+        """
+        total_costs_per_route = pd.Series(0.0, index=self.routes)
+        costs_per_period = None
+
+        fout = open(output_file, 'w', newline='') if output_file is not None else None
+        try:
+            for i, chunk in enumerate(read_discharge_chunks(discharge_file, chunksize=chunksize)):
+                # Reference discharge or local discharge per knelpunt
+                if column is not None:
+                    discharges = chunk[column]
+                elif all(k in chunk.columns for k in self.knelpunt_names):
+                    discharges = chunk[self.knelpunt_names]
+                else:
+                    assert len(chunk.columns) == 1, 'Give the column with the discharge at the reference point'
+                    discharges = chunk.iloc[:, 0]
+
+                if freq is None and fout is None:
+                    totals = self._fused_totals(discharges, occurance, delta)
+                    if totals is not None:
+                        total_costs_per_route += totals.values
+                        continue
+
+                costs = self.costs_per_discharge(discharges)
+                if delta:
+                    costs = costs.subtract(self.costs_no_problems.values, axis=1)
+                if occurance is not None:
+                    costs = costs.multiply(occurance)
+
+                total_costs_per_route += costs.sum(axis=0).values
+
+                if freq is not None:
+                    costs_chunk = costs.groupby(costs.index.to_period(freq)).sum()
+                    if costs_per_period is None:
+                        costs_per_period = costs_chunk
+                    else:
+                        costs_per_period = costs_per_period.add(costs_chunk, fill_value=0.0)
+
+                if fout is not None:
+                    costs.to_csv(fout, header=self._route_names() if i == 0 else False)
+        finally:
+            if fout is not None:
+                fout.close()
+
+        return total_costs_per_route, costs_per_period
+
+    def _depth_nodes(self, q_min: float, q_max: float):
+        """
+        Discharges at the reference point between which the depth at every knelpunt is linear, and the depths there
+
+        returns: (nodes, depths), sorted nodes including q_min and q_max, depths of shape (nodes, knelpunten)
+        """
+        Q_ref = self.knelpunt_distribution[self.knelpunt_reference][0]
+        nodes = [[q_min, q_max], Q_ref]
+
+        # Nodes of the discharge-depth relations, expressed as discharge at the reference point
+        for k in self.knelpunt_names:
+            Q_ref_k, Q_k = self.knelpunt_distribution[k]
+            nodes.append(_engine.linear_crossings(Q_ref_k, Q_k, self.knelpunt_relations[k][0]))
+        nodes = np.unique(np.concatenate(nodes))
+        nodes = nodes[(nodes >= q_min) & (nodes <= q_max)]
+
+        depths = self._compute_knelpunt_depth(self._compute_local_discharge(nodes)).to_numpy(dtype=float)
+        return nodes, depths
+
+    def _shared_routes(self) -> np.ndarray:
+        """Boolean matrix (knelpunten x knelpunten): True if the knelpunten are on the same route"""
+        incidence = self.route_index.incidence(self.knelpunt_names).astype(int)
+        return (incidence.T @ incidence) > 0
+
+    def discharge_breakpoints(self, q_min: float, q_max: float) -> np.ndarray:
+        """
+        Discharges at the reference point between which the costs of every route are linear in the discharge
+
+        These are the nodes of the discharge distribution and the discharge-depth relations, the discharges where the
+        draught at a knelpunt passes a point of the depth grid of the cost tables, and the discharges where the
+        limiting knelpunt on a route changes.
+
+        param q_min: lowest discharge at the reference point
+        param q_max: highest discharge at the reference point
+
+        returns: sorted array, including q_min and q_max
+        """
+        # Between these nodes the depth at every knelpunt is linear
+        nodes, depths = self._depth_nodes(q_min, q_max)
+        breakpoints = [nodes, _engine.linear_crossings(nodes, depths - self.ukc, self.route_costs_table.grid)]
+
+        # Changes of the limiting knelpunt, only for knelpunten that share a route
+        shared = self._shared_routes()
+        for i in range(len(self.knelpunt_names)):
+            partners = np.flatnonzero(shared[i, i + 1:]) + i + 1
+            if len(partners) > 0:
+                difference = depths[:, partners] - depths[:, [i]]
+                breakpoints.append(_engine.linear_crossings(nodes, difference, [0.0]))
+
+        return np.unique(np.concatenate(breakpoints))
+
+    @profiled('discharge_thresholds')
+    def discharge_thresholds(self, target, q_min: float, q_max: float, delta: bool = True) -> pd.Series:
+        """
+        Highest discharge at the reference point where the costs (per day) of each route are at least a target
+
+        For costs that decrease with the discharge, this is the discharge below which the route costs more than the
+        target. The costs are evaluated at discharge_breakpoints() only; they are linear in between, so the threshold
+        is exact.
+
+        param target: costs per day, a number or a value per column of the output
+        param q_min: lowest discharge at the reference point
+        param q_max: highest discharge at the reference point
+        param delta: target for the costs minus the costs without limitations, like in costs_for_scenario
+
+        returns: Series (index: routes). q_max if the costs are at or above the target at q_max, NaN if they are below
+            the target on the whole range
+        """
+        nodes = self.discharge_breakpoints(q_min, q_max)
+        costs = self.costs_per_discharge(nodes).to_numpy(dtype=float)
+        if delta:
+            costs = costs - self.costs_no_problems.values
+        target = np.broadcast_to(np.asarray(target, dtype=float), (costs.shape[1],))
+
+        # Last node at or above the target, and the crossing in the segment after it
+        above = costs >= target
+        last = len(nodes) - 1 - np.argmax(above[::-1], axis=0)
+        after = np.minimum(last + 1, len(nodes) - 1)
+        columns = np.arange(costs.shape[1])
+        c0, c1 = costs[last, columns], costs[after, columns]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (target - c0) / (c1 - c0)
+            thresholds = np.where(last == len(nodes) - 1, nodes[-1], nodes[last] + t * (nodes[after] - nodes[last]))
+        thresholds = np.where(above.any(axis=0), thresholds, np.nan)
+        return pd.Series(thresholds, index=self.routes, name='discharge')
+
+    @profiled('compile_global')
+    def compile_global(self, q_min: float, q_max: float, resolution: int = 100) -> _engine.ResponseSurface:
+        """
+        Tabulate the costs per route as function of the discharge at the reference point
+
+        After compiling, costs_per_discharge (and all methods based on it) evaluate discharges at the reference point
+        within [q_min, q_max] with a single interpolation per route. The table includes all breakpoints of the model,
+        so the result is the same as without compiling. Reading new relations removes the table.
+
+        param q_min: lowest discharge at the reference point
+        param q_max: highest discharge at the reference point
+        param resolution: number of additional equidistant discharges in the table
+
+        returns: ResponseSurface, also available as global_surface
+        """
+        self.global_surface = None
+
+        Q = np.union1d(np.linspace(q_min, q_max, resolution), self.discharge_breakpoints(q_min, q_max))
+        costs = self.costs_per_discharge(Q)
+        self.global_surface = _engine.ResponseSurface(Q, costs.values.T, ukc=self.ukc)
+        return self.global_surface
+
+    @profiled('costs_for_scenario_binned')
+    def costs_for_scenario_binned(self, discharges, occurance=None, delta: bool = True, method: str = 'breakpoints',
+                                  bins: int = 100):
+        """
+        Compute total costs in scenario on discharge classes instead of on every discharge
+
+        The discharges (at the reference point) are collected in classes, and the model is only run for the
+        occurance-weighted mean discharge of each class. Since the costs are piecewise linear in the discharge, the
+        error is bounded by the deviation from linearity within each class. With method 'breakpoints' the classes
+        follow the breakpoints of the model, so the result is exact.
+
+        param discharges: list of discharges at the reference point, or timeseries
+        param occurance: float, or list with for each discharge the number of days. If none, it assumes every discharges occured one day
+        param delta: subtract the costs without limitations, like in costs_for_scenario
+        param method: 'breakpoints' (classes between the breakpoints of the model), 'width' (classes of equal width)
+            or 'quantile' (classes with an equal number of discharges)
+        param bins: number of classes for method 'width' and 'quantile'
+
+        returns: (total_costs_per_route, error_bound_per_route)
+        """
+        assert np.ndim(discharges) == 1, 'Binning is only available for the discharge at the reference point'
+        Q = np.asarray(discharges, dtype=float)
+        if occurance is None:
+            occurance = 1.0
+        occurance = np.broadcast_to(np.asarray(occurance, dtype=float), Q.shape)
+
+        breakpoints = self.discharge_breakpoints(Q.min(), Q.max())
+        if method == 'breakpoints':
+            edges = breakpoints
+        elif method == 'width':
+            edges = np.linspace(Q.min(), Q.max(), bins + 1)
+        elif method == 'quantile':
+            edges = np.unique(np.quantile(Q, np.linspace(0, 1, bins + 1)))
+        else:
+            raise ValueError(f'Unknown binning method: {method}')
+
+        # Occurance and representative (weighted mean) discharge of each class
+        classes = (np.searchsorted(edges, Q, side='right') - 1).clip(0, max(len(edges) - 2, 0))
+        weight = np.bincount(classes, weights=occurance, minlength=len(edges))
+        Q_mean = np.bincount(classes, weights=occurance * Q, minlength=len(edges))
+        used = np.flatnonzero(weight)
+        Q_mean = Q_mean[used] / weight[used]
+        weight = weight[used]
+
+        costs = self.costs_per_discharge(Q_mean)
+        if delta:
+            costs = costs.subtract(self.costs_no_problems.values, axis=1)
+        total_costs_per_route = costs.multiply(weight, axis=0).sum(axis=0)
+
+        # Error bound: deviation of the costs from the line between the edges of each class, checked at all breakpoints
+        points = np.union1d(edges, breakpoints)
+        costs_points = self.costs_per_discharge(points).values
+        costs_edges = costs_points[np.searchsorted(points, edges)]
+        if len(edges) > 1:
+            def deviation(q, c):
+                b = (np.searchsorted(edges, q, side='right') - 1).clip(0, len(edges) - 2)
+                t = ((q - edges[b]) / (edges[b + 1] - edges[b]))[:, np.newaxis]
+                return np.abs(c - (costs_edges[b] + t * (costs_edges[b + 1] - costs_edges[b]))), b
+
+            deviation_points, b = deviation(points, costs_points)
+            deviation_max = np.zeros((len(edges), len(self.routes)))
+            np.maximum.at(deviation_max, b, deviation_points)
+
+            deviation_mean, b = deviation(Q_mean, costs.values + (self.costs_no_problems.values if delta else 0))
+            error = (weight[:, np.newaxis] * (deviation_max[b] + deviation_mean)).sum(axis=0)
+        else:
+            error = np.zeros(len(self.routes))
+
+        return total_costs_per_route, pd.Series(error, index=self.routes)
+
+    @profiled('costs_for_distribution')
+    def costs_for_distribution(self, cdf, days: float = 365, delta: bool = True):
+        """
+        Compute expected total costs for a discharge distribution, by exact integration
+
+        The distribution is a table of discharges at the reference point against the cumulative probability (of
+        exceedance or non-exceedance), linear in between, e.g. the columns of CDF.xlsx. Since the costs are piecewise
+        linear in the discharge, they are piecewise linear in the probability between the nodes of the table and the
+        breakpoints of the model. The trapezoidal rule over the union of these points is exact. All curves are
+        evaluated with a single call to costs_per_discharge.
+
+        param cdf: Series (index: probability, values: discharge), or DataFrame with a column per curve (e.g. T1, T2,
+            T100) on the same probabilities
+        param days: number of days the probabilities add up to, i.e. the costs are integrated over the probability
+            range of the table times days
+        param delta: subtract the costs without limitations, like in costs_for_scenario
+
+        returns: Series with the costs per route, or DataFrame (index: routes, columns: curves) for a DataFrame
+        """
+        curves = cdf.to_frame() if isinstance(cdf, pd.Series) else cdf
+        order = np.argsort(curves.index.values.astype(float), kind='mergesort')
+        p = curves.index.values.astype(float)[order]
+        Q = curves.values.astype(float)[order]
+        assert np.all(np.isfinite(Q)), 'Discharges in the distribution should not be missing'
+
+        # Probabilities of the nodes and breakpoints of every curve
+        breakpoints = self.discharge_breakpoints(Q.min(), Q.max())
+        nodes = []
+        for j in range(Q.shape[1]):
+            p_j = np.union1d(p, _engine.linear_crossings(p, Q[:, j], breakpoints))
+            nodes.append((p_j, np.interp(p_j, p, Q[:, j])))
+
+        # Costs at all discharges of all curves at once
+        Q_all, inverse = np.unique(np.concatenate([Q_j for _, Q_j in nodes]), return_inverse=True)
+        costs = self.costs_per_discharge(Q_all).values
+        if delta:
+            costs = costs - self.costs_no_problems.values
+
+        totals = {}
+        start = 0
+        for c, (p_j, Q_j) in zip(curves.columns, nodes):
+            costs_j = costs[inverse[start:start + len(Q_j)]]
+            start += len(Q_j)
+            totals[c] = days * (np.diff(p_j)[:, np.newaxis] * (costs_j[1:] + costs_j[:-1]) / 2).sum(axis=0)
+
+        totals = pd.DataFrame(totals, index=self.routes)
+        if isinstance(cdf, pd.Series):
+            return totals.iloc[:, 0].rename(cdf.name)
+        return totals
+
+    def _scenario_depths(self, discharges, occurance=None):
+        """
+        Depth per knelpunt for each discharge, and the occurance of each discharge as array
+
+        returns: (depths, occurance), shapes (discharges, knelpunten) and (discharges,)
+        """
+        # Changed depths can make pruned knelpunten limiting again
+        assert self.pruned is None, 'Changing depths requires a model without pruned routes'
+        assert discharges is not None, '[discharges] not given'
+        depths = self._compute_knelpunt_depth(self._compute_local_discharge(discharges)).values
+        if occurance is None:
+            occurance = 1.0
+        occurance = np.broadcast_to(np.asarray(occurance, dtype=float), (len(depths),))
+        return depths, occurance
+
+    def _totals_for_routes(self, depths, routes, occurance, delta: bool = True):
+        """
+        Compute total costs in scenario for some of the routes, directly from depths per knelpunt
+
+        param depths: depth per knelpunt, shape (..., discharges, knelpunten). Leading dimensions are evaluated at once
+        param routes: positions of the routes in route_index
+        param occurance: array with for each discharge the number of days
+        param delta: subtract the costs without limitations
+
+        returns: (totals, rows). totals has shape (..., rows), rows are the matching rows of route_costs_table (and
+            columns of the output), i.e. the routes for every metric
+        """
+        costs, rows = self._route_costs(depths, routes)
+
+        if delta:
+            costs = costs - self.costs_no_problems.values[rows].astype(costs.dtype)
+        return _engine.weighted_sum(costs, occurance, axis=-2), rows
+
+    @profiled('depth_sensitivity')
+    def depth_sensitivity(self, dh_values, knelpunten=None, discharges=None, occurance=None, delta: bool = True) -> pd.Series:
+        """
+        Compute total costs in scenario when the depth at one knelpunt is changed, for each knelpunt and depth change
+
+        The depth changes are applied to the computed depths as an extra dimension, so the discharge-depth relations
+        are not read again. For each knelpunt only the routes that pass it are evaluated, the other routes keep the
+        costs of the unchanged situation.
+
+        param dh_values: list of depth changes (positive is deeper)
+        param knelpunten: list of knelpunten that are changed one at a time. If None, all knelpunten
+        param discharges: list of unique discharges
+        param occurance: float, or list with for each discharge the number of days. If none, it assumes every discharges occured one day
+        param delta: subtract the costs without limitations, like in costs_for_scenario
+
+        returns: Series (index: dh, knelpunt, route)
+        """
+        dh_values = np.asarray(dh_values, dtype=float)
+        if knelpunten is None:
+            knelpunten = self.knelpunt_names
+        for k in knelpunten:
+            assert k in self.knelpunt_names, f'No discharge-depth relation for knelpunt {k}'
+
+        depths, occurance = self._scenario_depths(discharges, occurance)
+
+        # Costs in the unchanged situation
+        total_costs_per_route, _ = self._totals_for_routes(depths, np.arange(len(self.route_index)), occurance, delta)
+
+        totals = np.tile(total_costs_per_route, (len(dh_values), len(knelpunten), 1))
+        for i, k in enumerate(knelpunten):
+            routes = self.route_index.through(k)
+            if len(routes) == 0:
+                continue
+
+            # Depths with the change at this knelpunt, shape (dh, discharges, knelpunten)
+            depths_dh = np.repeat(depths[np.newaxis], len(dh_values), axis=0)
+            depths_dh[:, :, self.knelpunt_names.index(k)] += dh_values[:, np.newaxis]
+
+            totals_dh, rows = self._totals_for_routes(depths_dh, routes, occurance, delta)
+            totals[:, i, rows] = totals_dh
+
+        routes = [r if isinstance(r, tuple) else (r,) for r in self.routes]
+        index = pd.MultiIndex.from_tuples([(dh, k) + r for dh in dh_values for k in knelpunten for r in routes],
+                                          names=['dh', 'knelpunt'] + (self.routes.names if self.metrics else ['route']))
+        return pd.Series(totals.ravel(), index=index)
+
+    @profiled('required_deepening')
+    def required_deepening(self, saving, knelpunten=None, discharges=None, occurance=None, metric: str = None,
+                           points: int = 16) -> pd.DataFrame:
+        """
+        Smallest deepening of each knelpunt (one at a time) that reduces the total costs in scenario by a target
+
+        As a function of the depth change dh at one knelpunt, the total costs are linear between the dh where the
+        draught at the knelpunt passes a point of the depth grid of the cost tables, or passes the depth of another
+        knelpunt on the same route (for any of the discharges). The search evaluates the totals at these dh only,
+        points at a time, and solves the linear segment that reaches the target, so the result is exact. It assumes
+        that deeper water never costs more, as in the cost tables.
+
+        param saving: reduction of the total costs, a number or a value per knelpunt
+        param knelpunten: list of knelpunten. If None, all knelpunten
+        param discharges: list of unique discharges
+        param occurance: float, or list with for each discharge the number of days. If none, it assumes every discharges occured one day
+        param metric: metric to reduce when multiple metrics are loaded. Default: the first metric
+        param points: number of dh evaluated at once in every step of the search
+
+        returns: DataFrame (index: knelpunten) with columns dh (NaN if the saving can not be reached) and
+            max_saving, the reduction when the knelpunt is never limiting anymore
+        """
+        if knelpunten is None:
+            knelpunten = self.knelpunt_names
+        for k in knelpunten:
+            assert k in self.knelpunt_names, f'No discharge-depth relation for knelpunt {k}'
+        saving = np.broadcast_to(np.asarray(saving, dtype=float), (len(knelpunten),))
+
+        depths, occurance = self._scenario_depths(discharges, occurance)
+
+        weight = self._metric_weight(metric)
+
+        grid = self.route_costs_table.grid
+        shared = self._shared_routes()
+        result = pd.DataFrame(np.nan, index=pd.Index(knelpunten, name='knelpunt'), columns=['dh', 'max_saving'])
+        for i, k in enumerate(knelpunten):
+            j = self.knelpunt_names.index(k)
+            routes = self.route_index.through(k)
+            d = depths[:, j]
+
+            # dh where the costs of a route through k change slope
+            candidates = np.concatenate([
+                [0.0],
+                (grid[np.newaxis, :] + self.ukc - d[:, np.newaxis]).ravel(),
+                (depths[:, shared[j]] - d[:, np.newaxis]).ravel(),
+            ])
+            candidates = np.unique(candidates[candidates >= 0])  # also drops NaN
+
+            def reduction(dh):
+                # Saving for each dh, only the routes through k change
+                depths_dh = np.repeat(depths[np.newaxis], len(dh) + 1, axis=0)
+                depths_dh[1:, :, j] += dh[:, np.newaxis]
+                totals, rows = self._totals_for_routes(depths_dh, routes, occurance, delta=False)
+                totals = totals @ weight[rows]
+                return totals[0] - totals[1:]
+
+            if len(routes) == 0:
+                result.loc[k] = [0.0 if saving[i] <= 0 else np.nan, 0.0]
+                continue
+
+            # Beyond the last candidate the knelpunt is not limiting, or the draught is beyond the grid
+            lo, hi = 0, len(candidates) - 1
+            s_lo, s_hi = 0.0, reduction(candidates[-1:])[0]
+            result.loc[k, 'max_saving'] = s_hi
+            if saving[i] <= 0:
+                result.loc[k, 'dh'] = 0.0
+                continue
+            if s_hi < saving[i]:
+                continue
+
+            # Segment [lo, hi] of candidates with s_lo < saving <= s_hi
+            while hi - lo > 1:
+                probe = np.unique(np.linspace(lo, hi, points + 2).round().astype(int))
+                probe = probe[(probe > lo) & (probe < hi)]
+                s = reduction(candidates[probe])
+                reached = np.flatnonzero(s >= saving[i])
+                if len(reached) == 0:
+                    lo, s_lo = probe[-1], s[-1]
+                    continue
+                hi, s_hi = probe[reached[0]], s[reached[0]]
+                if reached[0] > 0:
+                    lo, s_lo = probe[reached[0] - 1], s[reached[0] - 1]
+
+            result.loc[k, 'dh'] = candidates[lo] + (saving[i] - s_lo) / (s_hi - s_lo) * (candidates[hi] - candidates[lo])
+        return result
+
+    @profiled('costs_ensemble')
+    def costs_ensemble(self, discharges=None, occurance=None, n: int = 1000, depth_std=0.1, correlation=0.0,
+                       cost_std: float = 0.0, percentiles=(5, 50, 95), seed: int = None, chunksize: int = None,
+                       delta: bool = True):
+        """
+        Monte Carlo ensemble of the total costs in scenario, for uncertain discharge-depth relations and cost curves
+
+        Each member shifts the discharge-depth relation of every knelpunt by a normally distributed depth, correlated
+        between knelpunten, and optionally multiplies the costs of every route by a normally distributed factor. The
+        members are evaluated as an extra dimension of the depths, in chunks of members to limit the memory use.
+        All random numbers are drawn before the evaluation, so the result does not depend on chunksize.
+
+        param discharges: list of unique discharges. Also supports timeseries
+        param occurance: float, or list with for each discharge the number of days. If none, it assumes every discharges occured one day
+        param n: number of members
+        param depth_std: standard deviation of the depth shift (m), a float or a dict {knelpunt: std} (missing: 0)
+        param correlation: correlation between the depth shifts of the knelpunten, a float (same for all pairs) or a
+            matrix (DataFrame or array) in the order of knelpunt_names
+        param cost_std: standard deviation of the factor on the costs of each route (mean 1)
+        param percentiles: percentiles to return
+        param seed: seed of the random number generator
+        param chunksize: number of members evaluated at once. Default: about 10 million values per chunk
+        param delta: subtract the costs without limitations, like in costs_for_scenario
+
+        returns: (percentiles per route, percentiles of the total over all routes). DataFrame (index: routes, columns:
+            percentiles) and Series (index: percentiles). With metrics the total is a DataFrame with a column per metric
+        """
+        depths, occurance = self._scenario_depths(discharges, occurance)
+        K = len(self.knelpunt_names)
+
+        if isinstance(depth_std, dict):
+            depth_std = [depth_std.get(k, 0.0) for k in self.knelpunt_names]
+        depth_std = np.broadcast_to(np.asarray(depth_std, dtype=float), (K,))
+        if np.ndim(correlation) == 0:
+            correlation = np.full((K, K), float(correlation))
+            np.fill_diagonal(correlation, 1.0)
+        correlation = np.asarray(correlation, dtype=float)
+        assert correlation.shape == (K, K), 'Correlation matrix should have a row and column per knelpunt'
+
+        rng = np.random.default_rng(seed)
+        covariance = correlation * np.outer(depth_std, depth_std)
+        offsets = rng.multivariate_normal(np.zeros(K), covariance, size=n, method='eigh')
+        factors = 1 + cost_std * rng.standard_normal((n, len(self.routes))) if cost_std > 0 else None
+
+        if chunksize is None:
+            chunksize = max(1, int(1e7 // max(1, len(depths) * len(self.routes))))
+
+        routes = np.arange(len(self.route_index))
+        totals = np.empty((n, len(self.routes)))
+        for start in range(0, n, chunksize):
+            members = slice(start, start + chunksize)
+            depths_m = depths[np.newaxis] + offsets[members, np.newaxis, :]
+            totals_m, rows = self._totals_for_routes(depths_m, routes, occurance, delta)
+            totals[members, rows] = totals_m if factors is None else totals_m * factors[members][:, rows]
+
+        percentiles = list(percentiles)
+        per_route = pd.DataFrame(np.percentile(totals, percentiles, axis=0).T, index=self.routes, columns=percentiles)
+        if self.metrics:
+            total = totals.reshape(n, len(self.metrics), -1).sum(axis=2)
+            total = pd.DataFrame(np.percentile(total, percentiles, axis=0), index=percentiles, columns=self.metrics)
+        else:
+            total = pd.Series(np.percentile(totals.sum(axis=1), percentiles), index=percentiles)
+        return per_route, total
+
+    @staticmethod
+    def _measure_options(candidates) -> dict:
+        """
+        Candidate measures as dict {knelpunt: (dh array, cost array)}
+
+        param candidates: dict {knelpunt: {dh: cost}}, dict {knelpunt: [dh, ...]} (cost 1 per measure), or DataFrame
+            with columns knelpunt, dh and optionally cost
+        """
+        if isinstance(candidates, pd.DataFrame):
+            if 'cost' not in candidates:
+                candidates = candidates.assign(cost=1.0)
+            candidates = {k: dict(zip(c['dh'], c['cost'])) for k, c in candidates.groupby('knelpunt', sort=False)}
+
+        options = {}
+        for k, c in candidates.items():
+            if not isinstance(c, dict):
+                c = {dh: 1.0 for dh in np.atleast_1d(c)}
+            options[k] = (np.array(list(c.keys()), dtype=float), np.array(list(c.values()), dtype=float))
+        return options
+
+    @profiled('optimize_measures')
+    def optimize_measures(self, candidates, budget: float = np.inf, discharges=None, occurance=None,
+                          method: str = 'greedy', beam_width: int = 10, metric: str = None):
+        """
+        Search the combination of depth improvements at knelpunten with the largest reduction of the total costs
+
+        At most one measure is taken per knelpunt. Combinations are built by adding one measure at a time. When a
+        measure is added, only the routes that pass its knelpunt are evaluated again; the totals of the other routes
+        are kept from the combination it was added to.
+
+        - greedy: add the measure with the largest reduction per unit of cost, until nothing fits the budget or
+          reduces the costs
+        - beam: keep the beam_width combinations with the lowest total costs after each step, stop when no new
+          combination is better than the best one so far
+
+        param candidates: dict {knelpunt: {dh: cost}}, dict {knelpunt: [dh, ...]} (cost 1 per measure), or DataFrame
+            with columns knelpunt, dh and optionally cost
+        param budget: maximum total cost of the measures
+        param discharges: list of unique discharges
+        param occurance: float, or list with for each discharge the number of days. If none, it assumes every discharges occured one day
+        param method: 'greedy' or 'beam'
+        param beam_width: number of combinations kept per step (beam)
+        param metric: metric to minimise when multiple metrics are loaded. Default: the first metric
+
+        returns: (measures, reduction, cost). measures is a Series with the depth change per knelpunt, reduction the
+            decrease of the total costs over all routes and cost the total cost of the measures
+        """
+        assert method in ('greedy', 'beam'), f'Unknown method: {method}'
+        options = self._measure_options(candidates)
+        for k in options:
+            assert k in self.knelpunt_names, f'No discharge-depth relation for knelpunt {k}'
+
+        depths, occurance = self._scenario_depths(discharges, occurance)
+
+        weight = self._metric_weight(metric)
+
+        totals, _ = self._totals_for_routes(depths, np.arange(len(self.route_index)), occurance)
+        # A combination: (objective, cost, offsets per knelpunt, totals per output column)
+        start = (weight @ totals, 0.0, np.zeros(len(self.knelpunt_names)), totals)
+
+        def expand(state):
+            """All combinations with one extra measure that fit the budget"""
+            objective, cost, offsets, totals = state
+            for k, (dh, dh_cost) in options.items():
+                column = self.knelpunt_names.index(k)
+                fits = (offsets[column] == 0) & (cost + dh_cost <= budget)
+                routes = self.route_index.through(k)
+                if not fits.any() or len(routes) == 0:
+                    continue
+
+                depths_dh = np.repeat((depths + offsets)[np.newaxis], fits.sum(), axis=0)
+                depths_dh[:, :, column] += dh[fits, np.newaxis]
+                totals_dh, rows = self._totals_for_routes(depths_dh, routes, occurance)
+                objective_dh = objective + (totals_dh - totals[rows]) @ weight[rows]
+
+                for i, j in enumerate(np.flatnonzero(fits)):
+                    new_offsets = offsets.copy()
+                    new_offsets[column] = dh[j]
+                    new_totals = totals.copy()
+                    new_totals[rows] = totals_dh[i]
+                    yield objective_dh[i], cost + dh_cost[j], new_offsets, new_totals
+
+        best = start
+        if method == 'greedy':
+            while True:
+                def ratio(s):
+                    gain = best[0] - s[0]
+                    return gain / (s[1] - best[1]) if s[1] > best[1] else np.inf * gain
+                children = [s for s in expand(best) if s[0] < best[0]]
+                if not children:
+                    break
+                best = max(children, key=ratio)
+        else:
+            beam = [start]
+            while beam:
+                children = {}
+                for state in beam:
+                    for s in expand(state):
+                        children.setdefault(s[2].tobytes(), s)
+                beam = sorted(children.values(), key=lambda s: (s[0], s[1]))[:beam_width]
+                if not beam or beam[0][0] >= best[0]:
+                    break
+                best = beam[0]
+
+        offsets = pd.Series(best[2], index=self.knelpunt_names)
+        return offsets[offsets != 0], start[0] - best[0], best[1]
+
+    def save(self, path: Union[str, Path]):
+        """
+        Save the model in binary format: a directory with a json header and the tables as .npy files
+
+        param path: directory
+        """
+        relations = [self.knelpunt_relations[k] for k in self.knelpunt_names]
+        distribution = [self.knelpunt_distribution[k] for k in self.knelpunt_names]
+
+        arrays = {'depth_grid': self.route_costs_table.grid,
+                  'route_costs': self.route_costs_table.values,
+                  'route_slopes': self.route_costs_table.slopes}
+        for name, pairs in [('relation', relations), ('distribution', distribution)]:
+            for i, part in enumerate(['x', 'y']):
+                arrays[f'{name}_{part}'], arrays[f'{name}_offsets'] = _storage.pack([p[i] for p in pairs])
+
+        header = {
+            'fingerprint': self._hash(self.route_costs_table.values),  # of the tables as written
+            'reference': self.knelpunt_reference,
+            'knelpunt_names': self.knelpunt_names,
+            'route_knelpunten': self.route_index.knelpunten,
+            'route_ids': self.route_index.route_ids,
+            'metrics': self.metrics,
+            'pruned': self.pruned,
+        }
+        _storage.write_model(path, header, arrays)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], mmap: bool = True, verify: bool = True, **kwargs) -> 'QINCM':
+        """
+        Load a model saved with save()
+
+        param path: directory
+        param mmap: memory map the tables instead of reading them, so processes can share them
+        param verify: check the fingerprint of the loaded model against the saved fingerprint
+        param kwargs: other arguments of QINCM (engine, cache_size, profile, dtype, prune, keep_last)
+        """
+        prune = kwargs.pop('prune', None)
+        M = cls(**kwargs)
+        with _stage(M, 'read'):
+            M._load(path, mmap=mmap, verify=verify)
+            if prune is not None:
+                M.prune_routes(*prune)
+        return M
+
+    def _load(self, path: Union[str, Path], mmap: bool = True, verify: bool = True):
+        """Read the tables of a saved model into this (empty) model, see load()"""
+        header, arrays = _storage.read_model(path, mmap=mmap)
+
+        route_knelpunten = header['route_knelpunten']
+        route_index = RouteIndex([[route_knelpunten[i] for i in ids] for ids in header['route_ids']],
+                                 knelpunten=route_knelpunten)
+        self._set_routes(route_index, _engine.RouteTable(arrays['depth_grid'], arrays['route_costs'], arrays['route_slopes']),
+                         metrics=header.get('metrics'))
+
+        self.knelpunt_reference = header['reference']
+        tables = {}
+        for name in ['relation', 'distribution']:
+            x = _storage.unpack(arrays[f'{name}_x'], arrays[f'{name}_offsets'])
+            y = _storage.unpack(arrays[f'{name}_y'], arrays[f'{name}_offsets'])
+            tables[name] = {k: (x[i], y[i]) for i, k in enumerate(header['knelpunt_names'])}
+        self._set_knelpunten(tables['relation'], tables['distribution'])
+        self.pruned = header.get('pruned')
+
+        # The tables as stored, before they are converted to the dtype of this model
+        self._fingerprint = self._hash(arrays['route_costs'])
+        if verify and self.fingerprint != header['fingerprint']:
+            raise ValueError(f'Fingerprint of model in {path} does not match')
+
+    @profiled('read_routes')
     def _read_routes_depth_costs(self, routes_depth_costs_file: Union[str, Path]):
         """
         # Set for each route (combination of knelpunten) the function of [draught]-[response].
@@ -188,31 +1192,171 @@ class QINCM:
         }
 
         """
+        if isinstance(routes_depth_costs_file, dict):
+            self._read_routes_depth_metrics(routes_depth_costs_file)
+            return
+
         # Read output
         routes_depth_costs = pd.read_json(routes_depth_costs_file, convert_dates=False, convert_axes=False)
-        routes_depth_costs.columns = [frozenset(i[1:-1].split(', ')) for i in routes_depth_costs.columns]
-        routes_depth_costs = routes_depth_costs.rename({frozenset({''}): frozenset()}, axis=1)
+
+        # Knelpunten as integer IDs, routes as bitmasks. Frozensets are only used as labels for output
+        route_index = RouteIndex.from_labels(routes_depth_costs.columns)
         routes_depth_costs.index = [float(c) for c in routes_depth_costs.index]
+        routes_depth_costs = routes_depth_costs.sort_index(kind='mergesort')
+
+        self._set_routes(route_index, _engine.RouteTable(routes_depth_costs.index.values, routes_depth_costs.values.T))
+
+    def _read_routes_depth_metrics(self, routes_depth_metric_files: dict):
+        """
+        Read several files in the format of _read_routes_depth_costs, e.g. costs, trips and tonnage
 
-        self.routes = routes_depth_costs.columns
+        All files must have the same routes and the same depth grid. The tables are stacked (metric by metric) into one
+        table, so the limiting draught of each route is computed once for all metrics.
 
-        # Convert into interpolation function
-        depth_costs_functions = {}
-        for r in self.routes:
-            depth_costs = routes_depth_costs.xs(r, axis=1)
-            # Test this also: depth_costs = routes_depth_costs.xs(r)
+        :param routes_depth_metric_files: {metric: file}
+        """
+        route_index = None
+        grid = None
+        tables = []
+        for metric, routes_depth_file in routes_depth_metric_files.items():
+            routes_depth_metric = pd.read_json(routes_depth_file, convert_dates=False, convert_axes=False)
+            routes_depth_metric.index = [float(c) for c in routes_depth_metric.index]
+            routes_depth_metric = routes_depth_metric.sort_index(kind='mergesort')
+
+            if route_index is None:
+                route_index = RouteIndex.from_labels(routes_depth_metric.columns)
+                grid = routes_depth_metric.index.values
+                order = np.arange(len(route_index))
+            else:
+                # Same routes, possibly in a different order
+                assert len(routes_depth_metric.columns) == len(route_index), f'Routes of {metric} do not match'
+                position = [route_index.find(parse_route_label(c)) for c in routes_depth_metric.columns]
+                assert sorted(position) == list(range(len(route_index))), f'Routes of {metric} do not match'
+                assert np.array_equal(routes_depth_metric.index.values, grid), f'Depths of {metric} do not match'
+                order = np.argsort(position)
 
-            depth_costs_function = interp1d(
-                x=depth_costs.index,
-                y=depth_costs.values,
-                kind='linear',
-                bounds_error=False,
-                fill_value=tuple(depth_costs.values[[0, -1]]),
-            )
-            depth_costs_functions[r] = depth_costs_function
+            tables.append(routes_depth_metric.values.T[order])
 
-        self.routes_depth_costs = depth_costs_functions
+        self._set_routes(route_index, _engine.RouteTable(grid, np.concatenate(tables)),
+                         metrics=list(routes_depth_metric_files.keys()))
+
+    def _set_routes(self, route_index: RouteIndex, route_costs_table: _engine.RouteTable, metrics: list = None):
+        """
+        Set the routes and the dense table of their cost curves (routes x depth grid)
+
+        With several metrics, the table holds the routes of each metric after each other and the output gets a
+        (metric, route) MultiIndex.
+        """
+        assert len(route_costs_table) == len(route_index) * (len(metrics) if metrics else 1)
+        assert metrics is None or self.engine == 'array', 'Several metrics require the array engine'
+
+        self.route_index = route_index
+        self.metrics = metrics
+        self.routes = pd.Index(route_index.labels(), tupleize_cols=False)
+        if metrics is not None:
+            self.routes = pd.MultiIndex.from_product([metrics, self.routes], names=['metric', 'route'])
+        self.route_costs_table = route_costs_table.astype(self.dtype)
+
+        # Costs without limitations: the deep end of the cost table of each route
+        self.costs_no_problems = pd.Series(self.route_costs_table.values[:, -1].astype(float), index=self.routes)
+
+        self._routes_depth_costs = None
+        self._fingerprint = None
+        self._last_evaluation = None
+        self.global_surface = None
+
+    @profiled('prune_routes')
+    def prune_routes(self, q_min: float, q_max: float) -> pd.DataFrame:
+        """
+        Remove knelpunten that can never be limiting from the routes, and merge routes that become equal
 
+        A knelpunt on a route is never limiting when, for all discharges at the reference point in [q_min, q_max],
+        it is at least as deep as another knelpunt on that route, or deep enough for the costs to be constant. Since
+        the depths are linear between the nodes of the relations, this is checked at those nodes. Routes that pass the
+        same remaining knelpunten are merged by summing their cost curves, so the costs summed over all routes do
+        not change within [q_min, q_max].
+
+        Afterwards only discharges at the reference point within [q_min, q_max] can be evaluated, and the depths can
+        not be changed. stats_knelpunten only counts trips at the remaining knelpunten of each route.
+
+        param q_min: lowest discharge at the reference point
+        param q_max: highest discharge at the reference point
+
+        returns: DataFrame (index: routes, knelpunten on all routes, most knelpunten on a route; columns: before,
+            after), also available as pruning
+        """
+        assert self.pruned is None, 'Routes are already pruned'
+        nodes, depths = self._depth_nodes(q_min, q_max)
+        K = len(self.knelpunt_names)
+
+        # Knelpunten that are never shallower than the deep end of the cost tables
+        never = (depths - self.ukc >= self.route_costs_table.grid[-1]).all(axis=0)
+
+        # dominated[a, b]: knelpunt a is never shallower than b, so b is limiting whenever a could be. Of equally
+        # deep knelpunten the first one is kept
+        shared = self._shared_routes()
+        deeper = np.zeros((K, K), dtype=bool)
+        for a in range(K):
+            partners = np.flatnonzero(shared[a])
+            deeper[a, partners] = (depths[:, [a]] >= depths[:, partners]).all(axis=0)
+        np.fill_diagonal(deeper, False)
+        dominated = deeper & (~deeper.T | (np.arange(K)[:, np.newaxis] > np.arange(K)))
+
+        # Remaining knelpunten of each route, routes with the same knelpunten form one group
+        members = self.route_members
+        keep = members < K
+        for position in range(members.shape[1]):
+            a = members[:, position]
+            valid = a < K
+            keep[valid, position] &= ~never[a[valid]]
+            for other in members.T:
+                both = valid & (other < K)
+                keep[both, position] &= ~dominated[a[both], other[both]]
+
+        groups = {}
+        group = np.empty(len(members), dtype=int)
+        for i, (m, k) in enumerate(zip(members, keep)):
+            group[i] = groups.setdefault(tuple(m[k]), len(groups))
+        route_index = RouteIndex([[self.knelpunt_names[a] for a in r] for r in groups],
+                                 knelpunten=self.route_index.knelpunten)
+
+        # Sum the cost curves of each group, for every metric
+        n_metrics = 1 if self.metrics is None else len(self.metrics)
+        rows = (np.arange(n_metrics)[:, np.newaxis] * len(groups) + group).ravel()
+        values = np.zeros((n_metrics * len(groups), len(self.route_costs_table.grid)))
+        np.add.at(values, rows, self.route_costs_table.values)
+
+        before = [len(members), int(keep.size - (members == K).sum()), members.shape[1]]
+        self._set_routes(route_index, _engine.RouteTable(self.route_costs_table.grid, values, dtype=self.dtype),
+                         metrics=self.metrics)
+        self.route_members = self.route_index.members(self.knelpunt_names)
+        self.pruned = [float(q_min), float(q_max)]
+        after = [len(self.route_members), int((self.route_members < K).sum()), self.route_members.shape[1]]
+
+        self.pruning = pd.DataFrame({'before': before, 'after': after},
+                                    index=['routes', 'knelpunten on all routes', 'most knelpunten on a route'])
+        return self.pruning
+
+    @property
+    def routes_depth_costs(self) -> dict:
+        """
+        Interpolation function of draught to costs for each route, used by the interp1d engine. Created when needed.
+        """
+        if self._routes_depth_costs is None:
+            grid = self.route_costs_table.grid
+            self._routes_depth_costs = {
+                r: interp1d(
+                    x=grid,
+                    y=costs,
+                    kind='linear',
+                    bounds_error=False,
+                    fill_value=(costs[0], costs[-1]),
+                )
+                for r, costs in zip(self.routes, self.route_costs_table.values)
+            }
+        return self._routes_depth_costs
+
+    @profiled('read_knelpunten')
     def _read_knelpunt_discharge_depth(self, knelpunt_discharge_depth_file: Union[str, Path], reference=None, depth_correction: dict=None):
         """
         Read json file with for each knelpunt the discharge-depth relation. The discharges for all knelpunten (probably)
@@ -248,103 +1392,185 @@ class QINCM:
             depth_correction = {}
 
 
-        self.knelpunt_names = list(discharge_depth.keys())
-
-        # For each knelpunt, create a discharge_depth interpolation function
-        self.knelpunt_discharge_depth = {}
+        # For each knelpunt, the discharge-depth relation
         knelpunt_discharge = {}
+        knelpunt_relations = {}
         for k, QD in discharge_depth.items():
             Q, D = zip(*QD.items())
             Q = np.array(Q, dtype=float)
             D = np.array(D, dtype=float) + depth_correction.get(k, 0.0)
 
-            # Make this an interpolation function, incl. extrapolation
-            discharge_depth_function = interp1d(
-                x=Q,
-                y=D,
-                kind='linear',
-                bounds_error=False,
-                fill_value='extrapolate',
-            )
-            self.knelpunt_discharge_depth[k] = discharge_depth_function
+            knelpunt_relations[k] = _engine.sort_relation(Q, D)
             knelpunt_discharge[k] = Q
 
-        # Make lookup function of discharge at reference, to local discharge
+        # Lookup of discharge at reference, to local discharge
         Q_ref = knelpunt_discharge[self.knelpunt_reference]
+        knelpunt_distribution = {k: _engine.sort_relation(Q_ref, Q) for k, Q in knelpunt_discharge.items()}
 
-        self.knelpunt_discharge_distribution = {}
-        for k in discharge_depth:
-            Q = knelpunt_discharge[k]
+        self._set_knelpunten(knelpunt_relations, knelpunt_distribution)
 
-            # Make this an interpolation function, extrapolation=constant
-            Qref_Q = interp1d(
-                x=Q_ref,
-                y=Q,
-                kind='linear',
-                bounds_error=False,
-                fill_value='extrapolate',
-            )
+    def _set_knelpunten(self, knelpunt_relations: dict, knelpunt_distribution: dict):
+        """
+        Set the discharge-depth relation and the discharge distribution of each knelpunt
 
-            self.knelpunt_discharge_distribution[k] = Qref_Q
+        :param knelpunt_relations: for each knelpunt (Q, D), sorted on Q
+        :param knelpunt_distribution: for each knelpunt (Q_ref, Q), sorted on Q_ref
+        """
+        assert self.pruned is None, 'Relations can not be changed when the routes are pruned'
+        self.knelpunt_names = list(knelpunt_relations.keys())
+        self.knelpunt_relations = knelpunt_relations
+        self.knelpunt_distribution = knelpunt_distribution
+
+        # Index of the knelpunten on each route, padded with len(knelpunt_names)
+        self.route_members = self.route_index.members(self.knelpunt_names)
+
+        self._knelpunt_discharge_depth = None
+        self._knelpunt_discharge_distribution = None
+        self._fingerprint = None
+        self._last_evaluation = None
+        self.global_surface = None
+
+    @profiled('update_knelpunt')
+    def update_knelpunt(self, name: str, relation: dict):
+        """
+        Replace the discharge-depth relation of one knelpunt
 
+        Only this knelpunt is changed: the discharge distribution (discharge at reference to local discharge) is kept.
+        With keep_last, the depths and costs of the last evaluation of costs_per_discharge are updated in place: the
+        depth of this knelpunt is computed again, and only the routes that pass it are evaluated again. Evaluating the
+        same discharges afterwards returns the updated costs without a full evaluation.
 
-    def stats_knelpunten(self, Qmin=500, Qmax=2000):
+        :param name: knelpunt
+        :param relation: {local discharge: depth}, like an entry of the knelpunt_discharge_depth file
+        :return: DataFrame with the updated costs per discharge of the last evaluation, or None if none is kept
+        """
+        assert name in self.knelpunt_names, f'No discharge-depth relation for knelpunt {name}'
+        assert self.pruned is None, 'Relations can not be changed when the routes are pruned'
+        Q, D = zip(*relation.items())
+        self.knelpunt_relations[name] = _engine.sort_relation(Q, D)
+
+        if self._knelpunt_discharge_depth is not None:
+            Q, D = self.knelpunt_relations[name]
+            self._knelpunt_discharge_depth[name] = interp1d(x=Q, y=D, kind='linear', bounds_error=False,
+                                                            fill_value='extrapolate')
+        self._fingerprint = None
+        self.global_surface = None
+
+        last = self._last_evaluation
+        if last is None:
+            return None
+
+        column = self.knelpunt_names.index(name)
+        last['depths'][:, column] = _engine.interp_extrapolate(last['discharges'][:, column],
+                                                               *self.knelpunt_relations[name])
+        routes = self.route_index.through(name)
+        if len(routes) > 0:
+            costs, rows = self._route_costs(last['depths'], routes)
+            last['costs'][:, rows] = costs
+        return pd.DataFrame(last['costs'].copy(), index=last['index'], columns=self.routes)
+
+    @property
+    def knelpunt_discharge_depth(self) -> dict:
+        """
+        Interpolation function of local discharge to depth for each knelpunt (incl. extrapolation). Created when needed.
+        """
+        if self._knelpunt_discharge_depth is None:
+            self._knelpunt_discharge_depth = {
+                k: interp1d(x=Q, y=D, kind='linear', bounds_error=False, fill_value='extrapolate')
+                for k, (Q, D) in self.knelpunt_relations.items()
+            }
+        return self._knelpunt_discharge_depth
+
+    @property
+    def knelpunt_discharge_distribution(self) -> dict:
+        """
+        Interpolation function of discharge at reference to local discharge for each knelpunt (incl. extrapolation).
+        Created when needed.
+        """
+        if self._knelpunt_discharge_distribution is None:
+            self._knelpunt_discharge_distribution = {
+                k: interp1d(x=Q_ref, y=Q, kind='linear', bounds_error=False, fill_value='extrapolate')
+                for k, (Q_ref, Q) in self.knelpunt_distribution.items()
+            }
+        return self._knelpunt_discharge_distribution
+
+    @profiled('stats_knelpunten')
+    def stats_knelpunten(self, Qmin=500, Qmax=2000, n: int = 100, discharges=None, workers: int = None):
         """
         for each discharge determine the number of trips that is influenced by the knelpunt (alltrips)
         for each knelpunt show only the trips that are limited by that specific point
 
-        return alltrips, mintrips
-        """
-
-        alltrips = {}
-        mintrips = {}
-        mintrips_increase = {}
-
-        routes = self.routes_depth_costs.keys()
+        All routes and knelpunten are evaluated at once: the limiting knelpunt of each route follows from the
+        route-knelpunt incidence, and the attribution to knelpunten is a weighted count over all (route, knelpunt)
+        pairs. If two knelpunten on a route are equally deep, the first in knelpunt_names is limiting.
 
-        discharge_series = np.linspace(Qmin, Qmax, 100)
+        :param Qmin: lowest discharge at the reference point
+        :param Qmax: highest discharge at the reference point
+        :param n: number of discharges between Qmin and Qmax
+        :param discharges: optional, discharges at the reference point to use instead of Qmin, Qmax and n. The
+            increase is relative to the last discharge.
+        :param workers: number of threads (-1 for all cores), each evaluates a block of discharges. The result does
+            not depend on the number of workers.
 
-        # Get discharge per knelpunt
-        Q_local = self._compute_local_discharge(discharge_series)
+        return alltrips, mintrips, mintrips_increase (DataFrames, index: discharges, columns: knelpunten)
+        """
+        if discharges is None:
+            discharges = np.linspace(Qmin, Qmax, n)
+        discharge_series = np.asarray(discharges, dtype=float)
 
         # Get depth per knelpunt and convert to draught by using ukc
-        QH = self._compute_knelpunt_depth(Q_local) - self.ukc
-
-        for r in routes:
-            # Depth on route
-            r_QH = QH[r]
-
-            # Get total costs on this route
-            depth_for_route = r_QH.min(axis=1).fillna(999)
-            costs_for_route = pd.Series(
-                data = self.routes_depth_costs[r](depth_for_route),
-                index = discharge_series
-            )
-            costs_for_route_increase = costs_for_route - costs_for_route.iloc[-1]
-
-            for k in r:
-
-                depth = r_QH[k].values
-
-                # Get number of affected trips (per waterdepth)
-                costs_for_all_passing_trips = self.routes_depth_costs[r](depth)
-                alltrips[(r, k)] = pd.Series(
-                    data=costs_for_all_passing_trips,
-                    index=discharge_series
-                )
-
-                # Only select those levels where k is the minimum depth on the route
-                k_minimal = r_QH.idxmin(axis=1) == k
-                mintrips[(r, k)] = costs_for_route.multiply(k_minimal, axis=0)
-                mintrips_increase[(r, k)] = costs_for_route_increase.multiply(k_minimal, axis=0)
-
-        alltrips = pd.concat(alltrips)
-        mintrips = pd.concat(mintrips)
-        mintrips_increase = pd.concat(mintrips_increase)
-
-        alltrips_sum = alltrips.unstack(level=1).sum(axis=0, level=1)
-        mintrips_sum = mintrips.unstack(level=1).sum(axis=0, level=1)
-        mintrips_increase_sum = mintrips_increase.unstack(level=1).sum(axis=0, level=1)
+        depths = self._compute_knelpunt_depth(self._compute_local_discharge(discharge_series)).values
+        draughts = _engine.with_no_limit(depths) - self.ukc
+        N, K = depths.shape
+
+        # All (route, knelpunt) pairs
+        pair_route, pair_position = np.nonzero(self.route_members < K)
+        pair_knelpunt = self.route_members[pair_route, pair_position]
+
+        tables = [self.route_costs_table.take(np.arange(len(self.route_index)) + m * len(self.route_index))
+                  for m in range(1 if self.metrics is None else len(self.metrics))]
+
+        # Costs on each route at the last discharge, the reference for the increase
+        _, index = _engine.limiting_depth(depths[-1:], self.route_members)
+        costs_last = [table(draughts[-1:], index=index)[0] for table in tables]
+
+        def per_knelpunt(values, knelpunt):
+            # Sum values (n, P) per discharge for the knelpunt (n, P) they belong to
+            n = len(values)
+            flat = (np.arange(n)[:, np.newaxis] * (K + 1) + knelpunt).ravel()
+            return np.bincount(flat, weights=values.ravel(), minlength=n * (K + 1)).reshape(n, K + 1)[:, :K]
+
+        def stats(block):
+            # Limiting knelpunt of each route (K if none)
+            _, index = _engine.limiting_depth(depths[block], self.route_members)
+            pair_index = np.broadcast_to(pair_knelpunt, (len(index), len(pair_knelpunt)))
+
+            results = {'alltrips': [], 'mintrips': [], 'mintrips_increase': []}
+            for table, costs_reference in zip(tables, costs_last):
+                # Costs on each route, at the limiting draught
+                costs_for_route = table(draughts[block], index=index)
+                costs_for_route_increase = costs_for_route - costs_reference
+
+                # Costs of all trips passing the knelpunt, as if it were the only knelpunt on the route
+                costs_for_all_passing_trips = table.take(pair_route)(draughts[block], index=pair_index)
+
+                results['alltrips'].append(per_knelpunt(costs_for_all_passing_trips, pair_index))
+                results['mintrips'].append(per_knelpunt(costs_for_route, index))
+                results['mintrips_increase'].append(per_knelpunt(costs_for_route_increase, index))
+            return {name: np.concatenate(values, axis=1) for name, values in results.items()}
+
+        workers = _parallel.n_workers(workers)
+        blocks = _parallel.map_blocks(stats, _parallel.split(N, workers), workers)
+        results = {name: [block[name] for block in blocks] for name in blocks[0]}
+
+        columns = pd.Index(self.knelpunt_names)
+        if self.metrics is not None:
+            columns = pd.MultiIndex.from_product([self.metrics, self.knelpunt_names], names=['metric', 'knelpunt'])
+
+        alltrips_sum, mintrips_sum, mintrips_increase_sum = [
+            pd.DataFrame(np.concatenate(results[name], axis=0), index=discharge_series, columns=columns)
+            for name in ['alltrips', 'mintrips', 'mintrips_increase']
+        ]
         return alltrips_sum, mintrips_sum, mintrips_increase_sum
 
 if __name__ == '__main__':
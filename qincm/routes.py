@@ -0,0 +1,145 @@
+"""Compact index of routes.
+
+Every knelpunt gets an integer ID and every route (a combination of knelpunten) is stored as a bitmask over these
+IDs, packed in uint64 words. Questions like "which routes pass knelpunt k" or "which routes only pass knelpunten in
+S" are then array operations instead of scans over sets of strings. Frozensets of names are only built for output.
+"""
+
+from typing import Iterable, Sequence
+import numpy as np
+
+_WORD = 64
+
+
+def parse_route_label(label: str) -> list:
+    """
+    Parse a route label as used in route_depth_costs.json, e.g. '{A, B}', into a list of knelpunt names
+
+    '{}' is the route without knelpunten.
+    """
+    names = label.strip()[1:-1].split(', ')
+    return [n for n in names if n != '']
+
+
+class RouteIndex:
+    """
+    Routes as bitmasks over integer knelpunt IDs
+    """
+
+    def __init__(self, routes: Iterable[Iterable[str]], knelpunten: Sequence[str] = None):
+        """
+        :param routes: for each route the names of the knelpunten it passes
+        :param knelpunten: optional, names of the knelpunten in the order of their IDs. Knelpunten on routes that are
+            not in this list are added at the end.
+        """
+        routes = [list(r) for r in routes]
+
+        self.knelpunten = list(knelpunten) if knelpunten is not None else []
+        self.ids = {k: i for i, k in enumerate(self.knelpunten)}
+        for r in routes:
+            for k in r:
+                if k not in self.ids:
+                    self.ids[k] = len(self.knelpunten)
+                    self.knelpunten.append(k)
+
+        # Knelpunt IDs per route, in the order as given
+        self.route_ids = [sorted(set(self.ids[k] for k in r)) for r in routes]
+
+        n_words = max(1, -(-len(self.knelpunten) // _WORD))
+        self.masks = np.zeros((len(routes), n_words), dtype=np.uint64)
+        for i, ids in enumerate(self.route_ids):
+            for k in ids:
+                self.masks[i, k // _WORD] |= np.uint64(1) << np.uint64(k % _WORD)
+
+        # Lookup tables: route by mask, and routes per knelpunt
+        self._by_mask = {m.tobytes(): i for i, m in enumerate(self.masks)}
+        self._through = [[] for _ in self.knelpunten]
+        for i, ids in enumerate(self.route_ids):
+            for k in ids:
+                self._through[k].append(i)
+        self._through = [np.array(t, dtype=int) for t in self._through]
+
+    @classmethod
+    def from_labels(cls, labels: Iterable[str], knelpunten: Sequence[str] = None) -> 'RouteIndex':
+        """Build the index from route labels as used in route_depth_costs.json, e.g. '{A, B}'"""
+        return cls([parse_route_label(label) for label in labels], knelpunten=knelpunten)
+
+    def __len__(self):
+        return len(self.masks)
+
+    def mask(self, knelpunten: Iterable[str]) -> np.ndarray:
+        """Bitmask of a set of knelpunten. Unknown knelpunten are ignored"""
+        mask = np.zeros(self.masks.shape[1], dtype=np.uint64)
+        for k in knelpunten:
+            if k in self.ids:
+                i = self.ids[k]
+                mask[i // _WORD] |= np.uint64(1) << np.uint64(i % _WORD)
+        return mask
+
+    def find(self, route: Iterable[str]) -> int:
+        """Position of a route, or -1 if the route does not exist"""
+        route = list(route)
+        if any(k not in self.ids for k in route):
+            return -1
+        return self._by_mask.get(self.mask(route).tobytes(), -1)
+
+    def through(self, knelpunt: str) -> np.ndarray:
+        """Positions of all routes that pass the knelpunt"""
+        if knelpunt not in self.ids:
+            return np.array([], dtype=int)
+        return self._through[self.ids[knelpunt]]
+
+    def subset_of(self, knelpunten: Iterable[str]) -> np.ndarray:
+        """Boolean array: routes that only pass knelpunten in the given set"""
+        outside = ~self.mask(knelpunten)
+        return ~((self.masks & outside) != 0).any(axis=1)
+
+    def superset_of(self, knelpunten: Iterable[str]) -> np.ndarray:
+        """Boolean array: routes that pass all knelpunten in the given set"""
+        knelpunten = list(knelpunten)
+        if any(k not in self.ids for k in knelpunten):
+            return np.zeros(len(self), dtype=bool)
+        mask = self.mask(knelpunten)
+        return ((self.masks & mask) == mask).all(axis=1)
+
+    def incidence(self, knelpunt_names: Sequence[str] = None) -> np.ndarray:
+        """
+        Boolean route-knelpunt matrix
+
+        :param knelpunt_names: order of the columns. Default: order of the IDs
+        :return: array of shape (routes, knelpunten)
+        """
+        if knelpunt_names is None:
+            knelpunt_names = self.knelpunten
+        incidence = np.zeros((len(self), len(knelpunt_names)), dtype=bool)
+        for j, k in enumerate(knelpunt_names):
+            incidence[self.through(k), j] = True
+        return incidence
+
+    def members(self, knelpunt_names: Sequence[str]) -> np.ndarray:
+        """
+        Columns in knelpunt_names of the knelpunten per route, as padded array for the array engine
+
+        Knelpunten that are not in knelpunt_names are left out.
+
+        :return: integer array of shape (routes, max. number of knelpunten on a route), padded with len(knelpunt_names)
+        """
+        column = {k: j for j, k in enumerate(knelpunt_names)}
+        lookup = np.array([column.get(k, len(knelpunt_names)) for k in self.knelpunten] + [len(knelpunt_names)])
+
+        width = max([len(ids) for ids in self.route_ids] + [1])
+        ids = np.full((len(self), width), len(self.knelpunten), dtype=int)
+        for i, r in enumerate(self.route_ids):
+            ids[i, :len(r)] = r
+        members = lookup[ids]
+
+        # Move the padding to the end of each row
+        return np.sort(members, axis=1)
+
+    def labels(self) -> list:
+        """Route labels as frozensets of knelpunt names (for output)"""
+        return [frozenset(self.knelpunten[k] for k in ids) for ids in self.route_ids]
+
+    def names(self) -> list:
+        """Route labels as readable strings, e.g. "{'A', 'B'}" (for output)"""
+        return ['{' + ', '.join(repr(self.knelpunten[k]) for k in ids) + '}' if ids else '' for ids in self.route_ids]
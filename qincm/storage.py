@@ -0,0 +1,71 @@
+"""Binary model format.
+
+A model is stored as a directory with a json header and one .npy file per array. The header holds the format
+version, the fingerprint of the model and everything that is not an array (names of knelpunten and routes). The
+arrays can be memory mapped when loading, so loading is fast and several processes share the same tables.
+"""
+
+from pathlib import Path
+from typing import Union
+import json
+import numpy as np
+
+FORMAT = 'qincm'
+VERSION = 1
+
+HEADER = 'header.json'
+
+
+def write_model(path: Union[str, Path], header: dict, arrays: dict):
+    """
+    Write header and arrays to a model directory
+
+    :param path: directory, created if it does not exist
+    :param header: json serialisable dictionary
+    :param arrays: dictionary of name: array
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    for name, a in arrays.items():
+        np.save(path / f'{name}.npy', np.ascontiguousarray(a), allow_pickle=False)
+
+    header = dict(header, format=FORMAT, version=VERSION, arrays=sorted(arrays))
+    with open(path / HEADER, 'w') as fout:
+        json.dump(header, fout, indent=1)
+
+
+def read_model(path: Union[str, Path], mmap: bool = True):
+    """
+    Read header and arrays from a model directory
+
+    :param path: directory written by write_model
+    :param mmap: memory map the arrays (read-only) instead of reading them into memory
+    :return: (header, arrays)
+    """
+    path = Path(path)
+    with open(path / HEADER) as fin:
+        header = json.load(fin)
+
+    if header.get('format') != FORMAT:
+        raise ValueError(f'{path} is not a QINCM model')
+    if header['version'] > VERSION:
+        raise ValueError(f'Model format version {header["version"]} is newer than supported ({VERSION})')
+
+    arrays = {
+        name: np.load(path / f'{name}.npy', mmap_mode='r' if mmap else None, allow_pickle=False)
+        for name in header['arrays']
+    }
+    return header, arrays
+
+
+def pack(arrays: list):
+    """Concatenate arrays of different length into one array with offsets"""
+    offsets = np.cumsum([0] + [len(a) for a in arrays])
+    data = np.concatenate(arrays) if len(arrays) > 0 else np.zeros(0)
+    return data, offsets
+
+
+def unpack(data, offsets) -> list:
+    """Inverse of pack"""
+    return [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
@@ -0,0 +1,72 @@
+"""Reading discharge time series from disk in chunks.
+
+CSV is read with pandas. Parquet requires pyarrow and NetCDF requires xarray; these are only imported when such a
+file is read.
+"""
+
+from pathlib import Path
+from typing import Iterator, Union
+import pandas as pd
+
+
+def _with_time_index(df: pd.DataFrame) -> pd.DataFrame:
+    """Use the first datetime column as index, if the index is not a time index yet"""
+    if isinstance(df.index, pd.DatetimeIndex):
+        return df
+    for c in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[c]):
+            return df.set_index(c)
+    return df
+
+
+def _read_csv(path, chunksize):
+    for chunk in pd.read_csv(path, index_col=0, parse_dates=True, chunksize=chunksize):
+        yield chunk
+
+
+def _read_parquet(path, chunksize):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Reading parquet files requires pyarrow')
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+        yield _with_time_index(batch.to_pandas())
+
+
+def _read_netcdf(path, chunksize, time='time'):
+    try:
+        import xarray as xr
+    except ImportError:
+        raise ImportError('Reading netcdf files requires xarray')
+
+    with xr.open_dataset(path) as ds:
+        for start in range(0, ds.sizes[time], chunksize):
+            chunk = ds.isel({time: slice(start, start + chunksize)}).load()
+            yield chunk.to_dataframe()
+
+
+readers = {
+    '.csv': _read_csv,
+    '.txt': _read_csv,
+    '.parquet': _read_parquet,
+    '.pq': _read_parquet,
+    '.nc': _read_netcdf,
+    '.netcdf': _read_netcdf,
+}
+
+
+def read_discharge_chunks(path: Union[str, Path], chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+    """
+    Read a discharge time series in chunks
+
+    The file has a time column (index) and either one column with the discharge at the reference point, or a
+    column per knelpunt.
+
+    :param path: csv, parquet or netcdf file
+    :param chunksize: number of time steps per chunk
+    :return: iterator over DataFrames
+    """
+    suffix = Path(path).suffix.lower()
+    assert suffix in readers, f'Unknown file type: {suffix}'
+    return readers[suffix](path, chunksize)
@@ -0,0 +1,100 @@
+"""Synthetic networks for benchmarks and scaling tests.
+
+The networks have the same file format as the real models, but arbitrary size: knelpunten with a rising
+discharge-depth relation, routes over random combinations of knelpunten with costs that decrease with the draught,
+and long daily discharge series at the reference point.
+"""
+
+from pathlib import Path
+from typing import Union
+import json
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+
+def synthetic_network(n_knelpunten: int = 1000, n_routes: int = 100000, max_route_length: int = 6,
+                      n_depths: int = 41, n_discharges: int = 5, seed: int = 0):
+    """
+    Generate a synthetic network
+
+    :param n_knelpunten: number of knelpunten. The first one is the reference point.
+    :param n_routes: number of routes, including the route without knelpunten
+    :param max_route_length: maximum number of knelpunten on a route
+    :param n_depths: number of points in the depth grid of the cost tables
+    :param n_discharges: number of points in the discharge-depth relation of each knelpunt
+    :param seed: seed of the random number generator
+    :return: (route_depth_costs, knelpunt_discharge_depth) as dicts in the format of the input files
+    """
+    rng = np.random.default_rng(seed)
+    names = [f'K{i:05d}' for i in range(n_knelpunten)]
+    assert n_routes <= 2 ** min(n_knelpunten, 62), 'Not enough knelpunten for this number of routes'
+
+    # Discharge-depth relations: discharge is a fraction of the discharge at the reference point
+    Q_ref = np.linspace(600, 6000, n_discharges)
+    fraction = np.r_[1.0, rng.uniform(0.1, 1.0, n_knelpunten - 1)]
+    depth_min = rng.uniform(1.5, 3.5, n_knelpunten)
+    depth_gain = rng.uniform(0.5, 3.0, n_knelpunten)
+    knelpunt_discharge_depth = {}
+    for k, f, d, g in zip(names, fraction, depth_min, depth_gain):
+        Q = np.round(f * Q_ref, 1)
+        D = np.round(d + g * np.sqrt((Q_ref - Q_ref[0]) / (Q_ref[-1] - Q_ref[0])), 3)
+        knelpunt_discharge_depth[k] = {str(q): float(h) for q, h in zip(Q, D)}
+
+    # Unique routes over random combinations of knelpunten
+    routes = {()}
+    while len(routes) < n_routes:
+        length = rng.integers(1, max_route_length + 1, n_routes)
+        for n in length[:n_routes - len(routes)]:
+            routes.add(tuple(sorted(rng.choice(n_knelpunten, n, replace=False))))
+    routes = sorted(routes, key=lambda r: (len(r), r))
+
+    # Costs per day: constant for deep water, rising steeply below a draught that differs per route
+    depths = np.round(np.linspace(0, 4, n_depths), 3)
+    base = rng.lognormal(8, 1.5, n_routes)[:, np.newaxis]
+    critical = rng.uniform(1.5, 3.5, n_routes)[:, np.newaxis]
+    costs = base * (1 + 3 / (1 + np.exp(4 * (depths - critical))))
+
+    route_depth_costs = {}
+    for r, c in zip(routes, np.round(costs, 2)):
+        label = '{' + ', '.join(names[k] for k in r) + '}'
+        route_depth_costs[label] = {str(d): float(v) for d, v in zip(depths, c)}
+    return route_depth_costs, knelpunt_discharge_depth
+
+
+def synthetic_discharges(n_days: int = 1000000, seed: int = 0) -> pd.Series:
+    """
+    Generate a daily discharge series at the reference point, with a seasonal cycle and persistent anomalies
+
+    :param n_days: number of days
+    :param seed: seed of the random number generator
+    :return: Series with a daily PeriodIndex, which (unlike nanosecond timestamps) covers more than 584 years
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_days)
+    seasonal = np.log(2200) + 0.35 * np.cos(2 * np.pi * t / 365.25)
+
+    # AR(1) anomalies
+    anomaly = lfilter([1.0], [1.0, -0.97], rng.normal(0, 0.08, n_days))
+
+    index = pd.period_range('1900-01-01', periods=n_days, freq='D')
+    return pd.Series(np.exp(seasonal + anomaly).clip(500, 12000), index=index, name='Q')
+
+
+def write_synthetic_network(path: Union[str, Path], **kwargs):
+    """
+    Write a synthetic network as route_depth_costs.json and knelpunt_discharge_waterdepth.json
+
+    :param path: directory, created if needed
+    :param kwargs: arguments of synthetic_network()
+    :return: (route_depth_costs_file, knelpunt_discharge_depth_file)
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    route_depth_costs, knelpunt_discharge_depth = synthetic_network(**kwargs)
+
+    files = path / 'route_depth_costs.json', path / 'knelpunt_discharge_waterdepth.json'
+    for file, data in zip(files, (route_depth_costs, knelpunt_discharge_depth)):
+        with open(file, 'w') as fout:
+            json.dump(data, fout)
+    return files
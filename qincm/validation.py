@@ -0,0 +1,71 @@
+"""Validation of the reduced precision (float32) mode against float64.
+
+    from qincm.validation import precision_report
+    precision_report('data')
+"""
+
+from pathlib import Path
+from typing import Union
+import numpy as np
+import pandas as pd
+
+from .qincm import QINCM
+
+# Bundled data sets and their reference point
+DATASETS = {
+    'testmodel_4p': 'WA_Nijmegen',
+    'testmodel_15p': 'WA_Nijmegen',
+    'application': 'BR_Lobith',
+    'application_WLO2050H': 'BR_Lobith',
+}
+
+
+def compare_precision(M: QINCM, M_reduced: QINCM, discharges) -> dict:
+    """
+    Deviation of a reduced precision model from the float64 model
+
+    :param M: float64 model
+    :param M_reduced: same model in reduced precision
+    :param discharges: discharges to evaluate
+    :return: dict with the maximum deviation of the costs per discharge relative to the largest costs of each route,
+        the maximum relative deviation of the total per route, the relative deviation of the total over all routes and
+        the memory of the costs per discharge relative to float64
+    """
+    costs = M.costs_per_discharge(discharges)
+    costs_reduced = M_reduced.costs_per_discharge(discharges)
+    scale = costs.abs().max(axis=0).replace(0, np.nan)
+
+    totals = M.costs_for_scenario(discharges)
+    totals_reduced = M_reduced.costs_for_scenario(discharges)
+    nonzero = totals != 0
+
+    return {
+        'costs_per_discharge': ((costs_reduced - costs).abs().max(axis=0) / scale).max(),
+        'total_per_route': ((totals_reduced - totals)[nonzero] / totals[nonzero]).abs().max(),
+        'total': abs(totals_reduced.sum() - totals.sum()) / abs(totals.sum()),
+        'memory': costs_reduced.values.nbytes / costs.values.nbytes,
+    }
+
+
+def precision_report(data_dir: Union[str, Path] = 'data', dtype=np.float32, n: int = 3650) -> pd.DataFrame:
+    """
+    Compare the bundled data sets in reduced precision with float64
+
+    :param data_dir: folder with the data sets
+    :param dtype: reduced precision type
+    :param n: number of discharges, equally spaced over the range of the reference relation
+    :return: DataFrame with a row per data set, see compare_precision() for the columns
+    """
+    report = {}
+    for name, reference in DATASETS.items():
+        files = Path(data_dir) / name / 'route_depth_costs.json', Path(data_dir) / name / 'knelpunt_discharge_waterdepth.json'
+        if not all(f.exists() for f in files):
+            continue
+
+        M = QINCM(*files, reference=reference)
+        M_reduced = QINCM(*files, reference=reference, dtype=dtype)
+
+        Q_ref = M.knelpunt_distribution[reference][0]
+        discharges = np.linspace(0.8 * Q_ref.min(), 1.5 * Q_ref.max(), n)
+        report[name] = compare_precision(M, M_reduced, discharges)
+    return pd.DataFrame(report).T
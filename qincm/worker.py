@@ -0,0 +1,168 @@
+"""Long-running worker for many scenarios.
+
+Requests are read as json lines from a stream (stdin) or a Unix socket, and every request gets one json line as
+result. A request contains the same configuration as the json file of the command line:
+
+    {"id": 1, "route_depth_costs_file": "...", "knelpunt_discharge_depth_file": "...", "reference": "WA_Nijmegen",
+     "mode": "scenario", "discharges": [...], "occurance": [...]}
+
+or "model" with a model saved with QINCM.save() instead of the input files. The result is
+
+    {"id": 1, "result": {route: costs}}
+
+with the same result as the command line, or {"id": 1, "error": "..."} if the request failed. Models are kept in a
+cache, keyed by their input files (and the modification time of the files), so only the first request for a model
+reads it.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+import socketserver
+import stat
+import threading
+
+from .cache import LRUCache
+from .qincm import QINCM
+
+logger = logging.getLogger(__name__)
+
+
+def _key(value):
+    """Hashable key of a configuration value. Files are keyed by their path and modification time."""
+    if isinstance(value, dict):
+        return tuple((k, _key(v)) for k, v in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_key(v) for v in value)
+    if isinstance(value, (str, Path)) and os.path.exists(value):
+        return str(Path(value).resolve()), os.stat(value).st_mtime_ns
+    return value
+
+
+def format_result(M: QINCM, result) -> str:
+    """Json of the result with readable route names, as written by the command line"""
+    result_pretty = result.copy()
+    result_pretty.index = M.route_index.names()
+    return result_pretty.to_json()
+
+
+def evaluate(M: QINCM, config: dict) -> str:
+    """
+    Run the scenario of a configuration on a model
+
+    :return: json of the result, see format_result()
+    """
+    mode = config.get('mode', 'scenario')
+    if mode != 'scenario':
+        raise NotImplementedError(f'Mode [{mode}] is not implemented, only [scenario]')
+    if config.get('output') is not None:
+        from .output import write_costs
+
+        write_costs(M, config['output'], config['discharges'], config.get('occurance'),
+                    per_discharge=config.get('per_discharge', False))
+        return json.dumps(config['output'])
+
+    result = M.costs_for_scenario(discharges=config['discharges'], occurance=config.get('occurance'))
+    return format_result(M, result)
+
+
+class ModelCache:
+    """Models by configuration, the least recently used model is removed when the cache is full"""
+
+    def __init__(self, maxsize: int = 8):
+        self._models = LRUCache(maxsize)
+
+    def __len__(self):
+        return len(self._models)
+
+    @property
+    def hits(self) -> int:
+        return self._models.hits
+
+    @property
+    def misses(self) -> int:
+        return self._models.misses
+
+    def get(self, config: dict) -> QINCM:
+        """Model of a configuration, read it if it is not in the cache"""
+        if config.get('model') is not None:
+            key = ('model', _key(config['model']))
+        else:
+            key = ('files', _key(config['route_depth_costs_file']), _key(config['knelpunt_discharge_depth_file']),
+                   config.get('reference'))
+
+        if key in self._models:
+            return self._models[key]
+
+        if config.get('model') is not None:
+            logger.info(f"Loading model: {config['model']}")
+            M = QINCM.load(config['model'])
+        else:
+            logger.info(f"Reading model: {config['route_depth_costs_file']}")
+            M = QINCM(config['route_depth_costs_file'], config['knelpunt_discharge_depth_file'],
+                      reference=config.get('reference'))
+        self._models[key] = M
+        return M
+
+    def clear(self):
+        self._models.clear()
+
+
+def handle(line: str, models: ModelCache) -> str:
+    """Result of one request line as a json line (without newline). Failed requests give an error."""
+    request_id = None
+    try:
+        config = json.loads(line)
+        request_id = config.get('id')
+        result = evaluate(models.get(config), config)
+    except Exception as e:
+        logger.exception('Request failed')
+        return json.dumps({'id': request_id, 'error': f'{type(e).__name__}: {e}'})
+    return f'{{"id": {json.dumps(request_id)}, "result": {result}}}'
+
+
+def serve_stream(fin, fout, models: ModelCache = None):
+    """
+    Handle the requests on fin until it is closed, the results are written to fout in the same order
+
+    :param fin: readable text stream, one request per line. Empty lines are skipped.
+    :param fout: writable text stream, flushed after every result
+    :param models: cache of models, e.g. to share it between streams
+    """
+    models = ModelCache() if models is None else models
+    for line in fin:
+        if not line.strip():
+            continue
+        fout.write(handle(line, models) + '\n')
+        fout.flush()
+
+
+def serve_socket(path: str, models: ModelCache = None):
+    """
+    Handle requests on a Unix socket until interrupted
+
+    Every connection is a stream of requests as in serve_stream(). Connections are handled in parallel, the requests
+    one at a time, so the models in the cache are never used by two requests at once.
+    """
+    models = ModelCache() if models is None else models
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                with lock:
+                    result = handle(line.decode(), models)
+                self.wfile.write(result.encode() + b'\n')
+                self.wfile.flush()
+
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.remove(path)  # left by a previous worker
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        logger.info(f'Listening on {path}')
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
@@ -2,7 +2,17 @@ import unittest
 from click.testing import CliRunner
 
 from qincm import cli
+from qincm.qincm import QINCM
+from pathlib import Path
+import tempfile
 import json
+import subprocess
+import sys
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
 
 class test_cli(unittest.TestCase):
 
@@ -27,6 +37,12 @@ class test_cli(unittest.TestCase):
         assert 'Show this message and exit.' in help_result.output
 
 
+    def test_CLI_lazy_imports(self):
+        # The command line starts without importing the model
+        code = "import sys, qincm, qincm.cli; print(sorted({'pandas', 'scipy'} & set(sys.modules)))"
+        modules = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(modules.strip(), '[]')
+
     def test_CLI_test1_config(self):
         runner = CliRunner()
 
@@ -73,6 +89,105 @@ class test_cli(unittest.TestCase):
         output = json.loads(result.output)
         self.assertEqual(output["{'WA_Nijmegen'}"], self.test1_output["{'WA_Nijmegen'}"])
 
+    def test_CLI_test1_model(self):
+        runner = CliRunner()
+
+        inputfile = r'tests/data/test1.json'
+        with open(inputfile, 'r') as fin:
+            inputfile_data = json.load(fin)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            model = Path(tmpdir) / 'model'
+            QINCM(
+                inputfile_data['route_depth_costs_file'],
+                inputfile_data['knelpunt_discharge_depth_file'],
+                reference=inputfile_data['reference']
+            ).save(model)
+
+            result = runner.invoke(cli.main, [
+                '--model', str(model),
+                '--discharges', json.dumps(inputfile_data['discharges']),
+                '--occurance', json.dumps(inputfile_data['occurance'])
+            ])
+
+        assert result.exit_code == 0
+
+        output = json.loads(result.output)
+        self.assertEqual(output["{'WA_Nijmegen'}"], self.test1_output["{'WA_Nijmegen'}"])
+
+    def test_CLI_test1_profile(self):
+        runner = CliRunner()
+
+        inputfile = r'tests/data/test1.json'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            profile = Path(tmpdir) / 'profile.json'
+            result = runner.invoke(cli.main, ['--config', inputfile, '--profile', str(profile)])
+            assert result.exit_code == 0
+
+            with open(profile) as fin:
+                report = json.load(fin)
+
+        for stage in ['read', 'local_discharge', 'depth', 'routes', 'costs_for_scenario']:
+            self.assertEqual(report['stages'][stage]['calls'], 1)
+        self.assertGreater(report['peak_memory'], 0)
+
+    @unittest.skipIf(pq is None, 'pyarrow is not installed')
+    def test_CLI_test1_output(self):
+        runner = CliRunner()
+
+        inputfile = r'tests/data/test1.json'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = Path(tmpdir) / 'output.parquet'
+            result = runner.invoke(cli.main, ['--config', inputfile, '--output', str(output)])
+            assert result.exit_code == 0
+            table = pq.read_table(output).to_pydict()
+
+            output = Path(tmpdir) / 'output_per_discharge.parquet'
+            result = runner.invoke(cli.main, ['--config', inputfile, '--output', str(output), '--per_discharge'])
+            assert result.exit_code == 0
+            table_per_discharge = pq.read_table(output).to_pydict()
+
+            # Local discharges per knelpunt have no discharge per row
+            config = {'model': None, 'route_depth_costs_file': 'data/testmodel_4p/route_depth_costs.json',
+                      'knelpunt_discharge_depth_file': 'data/testmodel_4p/knelpunt_discharge_waterdepth.json',
+                      'reference': 'WA_Nijmegen', 'mode': 'scenario', 'discharges': [[1000, 800, 200, 100]],
+                      'occurance': [1], 'output': str(output), 'per_discharge': True}
+            result = runner.invoke(cli.main, ['--config', json.dumps(config)])
+            self.assertIsInstance(result.exception, AssertionError)
+            self.assertIn('--per_discharge', str(result.exception))
+
+        self.assertEqual(len(table['costs']), len(self.test1_output))
+        costs = dict(zip(map(tuple, table['route']), table['costs']))
+        self.assertAlmostEqual(costs[('WA_Nijmegen',)], self.test1_output["{'WA_Nijmegen'}"])
+        self.assertEqual(costs[()], 0.0)
+
+        self.assertEqual(len(table_per_discharge['costs']), 26 * len(self.test1_output))
+        self.assertEqual(set(table_per_discharge), {'discharge', 'occurance', 'route', 'costs'})
+        total = sum(c * o for r, c, o in zip(table_per_discharge['route'], table_per_discharge['costs'],
+                                             table_per_discharge['occurance']) if r == ['WA_Nijmegen'])
+        self.assertAlmostEqual(total, self.test1_output["{'WA_Nijmegen'}"], places=4)
+
+    def test_CLI_batch(self):
+        runner = CliRunner()
+
+        inputfile = r'tests/data/test1.json'
+        with open(inputfile, 'r') as fin:
+            inputfile_data = json.load(fin)
+        requests = [dict(inputfile_data, id=i) for i in range(3)]
+        requests[1]['mode'] = 'timeseries'
+
+        result = runner.invoke(cli.main, ['batch'], input='\n'.join(json.dumps(r) for r in requests) + '\n')
+        assert result.exit_code == 0
+
+        output = [json.loads(line) for line in result.output.splitlines()]
+        self.assertEqual([o['id'] for o in output], [0, 1, 2])
+        self.assertIn('NotImplementedError', output[1]['error'])
+
+        # Same result as a single run
+        single = runner.invoke(cli.main, ['--config', inputfile])
+        self.assertEqual(output[0]['result'], json.loads(single.output))
+        self.assertEqual(output[2]['result'], output[0]['result'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,12 +3,34 @@
 """Tests for `qincm` package."""
 
 import unittest
+import tempfile
 
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import json
 
 from qincm.qincm import QINCM
+
+try:
+    import xarray as xr
+except ImportError:
+    xr = None
+
+try:
+    import dask
+except ImportError:
+    dask = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
 # from qincm import cli
 
 class test_pyFIS(unittest.TestCase):
@@ -18,12 +40,12 @@ class test_pyFIS(unittest.TestCase):
     def setUp(self):
         """Set up test fixtures"""
         inputdir = Path('data/testmodel_4p')
-        route_depth_costs_file = inputdir / 'route_depth_costs.json'
-        knelpunt_discharge_depth_file = inputdir / 'knelpunt_discharge_waterdepth.json'
+        self.route_depth_costs_file = inputdir / 'route_depth_costs.json'
+        self.knelpunt_discharge_depth_file = inputdir / 'knelpunt_discharge_waterdepth.json'
 
         self.M = QINCM(
-            route_depth_costs_file,
-            knelpunt_discharge_depth_file,
+            self.route_depth_costs_file,
+            self.knelpunt_discharge_depth_file,
             reference='WA_Nijmegen'
         )
 
@@ -89,3 +111,593 @@ class test_pyFIS(unittest.TestCase):
         self.assertAlmostEqual(alltrips_sum.loc[500, 'WA_Nijmegen'], 8400926.746089742, 5)
         self.assertAlmostEqual(mintrips_sum.loc[500, 'WA_Nijmegen'], 8400926.746089742, 5)
         self.assertAlmostEqual(mintrips_increase_sum.loc[500, 'WA_Nijmegen'], 5046180.066089741, 5)
+
+    def test_004_engine(self):
+        # The array engine gives the same results as the reference implementation
+        M_ref = QINCM(
+            self.route_depth_costs_file,
+            self.knelpunt_discharge_depth_file,
+            reference='WA_Nijmegen',
+            engine='interp1d'
+        )
+
+        np.random.seed(13)
+        discharges_local = np.random.rand(20, len(self.M.knelpunt_names)) * 3000
+        discharges_global = np.linspace(0, 5000, 51)
+
+        for discharges in [discharges_global, discharges_local]:
+            a = self.M.costs_per_discharge(discharges)
+            b = M_ref.costs_per_discharge(discharges)
+            pd.testing.assert_frame_equal(a, b)
+
+        # Route-major evaluation equals the limiting knelpunt per route, also with missing depths and blocks
+        from qincm import engine as _engine
+        depths = np.random.rand(3, 40, len(self.M.knelpunt_names)) * 10
+        depths[depths < 1] = np.nan
+        _, index = _engine.limiting_depth(depths, self.M.route_members)
+        expected = self.M.route_costs_table(_engine.with_no_limit(depths) - self.M.ukc, index=index)
+        for blocksize in [1, 2 ** 18]:
+            result = _engine.route_costs(self.M.route_costs_table, depths, self.M.route_members, self.M.ukc,
+                                         blocksize=blocksize)
+            np.testing.assert_array_equal(result, expected)
+
+    def test_005_route_index(self):
+        index = self.M.route_index
+        self.assertEqual(len(index), len(self.M.routes))
+        self.assertEqual(index.labels(), list(self.M.routes))
+
+        # Lookups on the bitmasks give the same answer as set operations on the labels
+        through = [r for r in self.M.routes if 'WA_Nijmegen' in r]
+        self.assertEqual([self.M.routes[i] for i in index.through('WA_Nijmegen')], through)
+
+        S = {'WA_Nijmegen', 'IJ_Velp'}
+        self.assertEqual(list(index.subset_of(S)), [r <= S for r in self.M.routes])
+        self.assertEqual(list(index.superset_of(S)), [r >= S for r in self.M.routes])
+
+        self.assertEqual(index.find(['IJ_Velp', 'WA_Nijmegen']), list(self.M.routes).index(frozenset(S)))
+        self.assertEqual(index.find([]), list(self.M.routes).index(frozenset()))
+        self.assertEqual(index.find(['unknown']), -1)
+
+    def test_006_depth_sensitivity(self):
+        discharges = np.linspace(500, 3000, 26)
+        np.random.seed(13)
+        occurance = np.random.rand(*discharges.shape)
+        dh_values = [-0.2, 0.0, 0.3]
+        knelpunten = ['WA_Nijmegen', 'IJ_Velp']
+
+        a = self.M.depth_sensitivity(dh_values, knelpunten, discharges, occurance)
+        self.assertEqual(len(a), len(dh_values) * len(knelpunten) * len(self.M.routes))
+
+        # Same as changing the discharge-depth relation and rerunning the scenario
+        with open(self.knelpunt_discharge_depth_file) as fin:
+            discharge_depth = json.load(fin)
+
+        for dh in dh_values:
+            for k in knelpunten:
+                discharge_depth_dh = {n: {q: d + dh if n == k else d for q, d in QD.items()} for n, QD in discharge_depth.items()}
+                M = QINCM(self.route_depth_costs_file, discharge_depth_dh, reference='WA_Nijmegen')
+                b = M.costs_for_scenario(discharges, occurance)
+
+                np.testing.assert_allclose(a.xs((dh, k), level=['dh', 'knelpunt']).values, b.values, rtol=1e-9, atol=1e-3)
+
+    def test_006_depth_sensitivity_without_discharges(self):
+        with self.assertRaises(AssertionError):
+            self.M.depth_sensitivity([0.1])
+        with self.assertRaises(AssertionError):
+            self.M.costs_ensemble(n=3)
+        with self.assertRaises(AssertionError):
+            self.M.optimize_measures({'IJ_Velp': [0.5]})
+        with self.assertRaises(AssertionError):
+            self.M.required_deepening(1e6)
+
+    def test_007_cache(self):
+        M = QINCM(
+            self.route_depth_costs_file,
+            self.knelpunt_discharge_depth_file,
+            reference='WA_Nijmegen',
+            cache_size=2
+        )
+        discharges = np.linspace(500, 3000, 26)
+
+        a = M.costs_per_discharge(discharges)
+        b = M.costs_per_discharge(discharges)
+        pd.testing.assert_frame_equal(a, b)
+        pd.testing.assert_frame_equal(a, self.M.costs_per_discharge(discharges))
+        self.assertEqual((M.cache.hits, M.cache.misses), (1, 1))
+
+        # Changing the relations changes the fingerprint of the model
+        with open(self.knelpunt_discharge_depth_file) as fin:
+            discharge_depth = json.load(fin)
+        discharge_depth['WA_Nijmegen'] = {q: d + 0.5 for q, d in discharge_depth['WA_Nijmegen'].items()}
+        M._read_knelpunt_discharge_depth(discharge_depth, reference='WA_Nijmegen')
+
+        c = M.costs_per_discharge(discharges)
+        self.assertEqual(M.cache.misses, 2)
+        self.assertLess(c.loc[500].sum(), a.loc[500].sum())
+
+    def test_007_costs_no_problems(self):
+        # The baseline is the deep end of the cost table, also for knelpunten with a constant depth
+        self.assertEqual(list(self.M.costs_no_problems.values), list(self.M.route_costs_table.values[:, -1]))
+        a = self.M.costs_for_scenario(np.linspace(500, 3000, 26))
+        b = self.M.costs_for_scenario(np.linspace(500, 3000, 26), delta=False)
+        self.assertAlmostEqual(b.sum() - a.sum(), 26 * self.M.costs_no_problems.sum(), 3)
+
+    def test_008_costs_for_file(self):
+        discharges = np.linspace(500, 3000, 1000)
+        dates = pd.date_range('2000-01-01', periods=len(discharges), freq='1D')
+        timeseries = pd.Series(index=dates, data=discharges, name='Q')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            inputfile = Path(tmpdir) / 'discharges.csv'
+            outputfile = Path(tmpdir) / 'costs.csv'
+            timeseries.to_csv(inputfile)
+
+            totals, per_year = self.M.costs_for_file(inputfile, freq='Y', chunksize=300, output_file=outputfile)
+            costs = pd.read_csv(outputfile, index_col=0, parse_dates=True)
+
+        expected = self.M.costs_for_scenario(timeseries)
+        np.testing.assert_allclose(totals.values, expected.values, rtol=1e-10)
+        np.testing.assert_allclose(per_year.sum(axis=0).values, expected.values, rtol=1e-10)
+        self.assertEqual(list(per_year.index.year), [2000, 2001, 2002])
+        self.assertEqual(costs.shape, (len(discharges), len(self.M.routes)))
+
+        # Local discharge per knelpunt
+        local = self.M._compute_local_discharge(timeseries)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            inputfile = Path(tmpdir) / 'discharges.csv'
+            local.to_csv(inputfile)
+            totals, _ = self.M.costs_for_file(inputfile, chunksize=300)
+        np.testing.assert_allclose(totals.values, expected.values, rtol=1e-10)
+
+    def test_009_binned_scenario(self):
+        np.random.seed(13)
+        discharges = np.random.rand(5000) * 3000 + 300
+        occurance = np.random.rand(5000)
+
+        expected = self.M.costs_for_scenario(discharges, occurance)
+
+        # Classes between the breakpoints of the model are exact
+        a, error = self.M.costs_for_scenario_binned(discharges, occurance, method='breakpoints')
+        np.testing.assert_allclose(a.values, expected.values, rtol=1e-9, atol=1e-3)
+        self.assertLess(error.sum(), 1e-6 * expected.sum())
+
+        # Other classes are within the error bound
+        for method in ['width', 'quantile']:
+            a, error = self.M.costs_for_scenario_binned(discharges, occurance, method=method, bins=20)
+            self.assertTrue(np.all(np.abs(a - expected).values <= error.values + 1e-3))
+
+    def test_010_compile_global(self):
+        np.random.seed(13)
+        discharges = np.random.rand(1000) * 3000 + 300
+        expected = self.M.costs_per_discharge(discharges)
+
+        surface = self.M.compile_global(300, 3300, resolution=10)
+        self.assertIs(self.M.global_surface, surface)
+
+        a = self.M.costs_per_discharge(discharges)
+        np.testing.assert_allclose(a.values, expected.values, rtol=1e-10)
+        pd.testing.assert_index_equal(a.index, expected.index)
+
+        # Outside of the table the model is used
+        b = self.M.costs_per_discharge([100, 5000])
+        pd.testing.assert_frame_equal(b, QINCM(self.route_depth_costs_file, self.knelpunt_discharge_depth_file, reference='WA_Nijmegen').costs_per_discharge([100, 5000]))
+
+        # Reading new relations removes the table
+        self.M._read_knelpunt_discharge_depth(self.knelpunt_discharge_depth_file, reference='WA_Nijmegen')
+        self.assertIsNone(self.M.global_surface)
+
+    def test_011_save_load(self):
+        discharges = np.linspace(500, 3000, 26)
+        expected = self.M.costs_per_discharge(discharges)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / 'testmodel_4p.qincm'
+            self.M.save(path)
+
+            for mmap in [True, False]:
+                M = QINCM.load(path, mmap=mmap)
+                self.assertEqual(M.fingerprint, self.M.fingerprint)
+                pd.testing.assert_frame_equal(M.costs_per_discharge(discharges), expected)
+                self.assertEqual(M.knelpunt_names, self.M.knelpunt_names)
+                del M
+
+            M = QINCM.load(path, engine='interp1d')
+            pd.testing.assert_frame_equal(M.costs_per_discharge(discharges), expected)
+            del M
+
+            # Load in another precision, and the other way around
+            M32 = QINCM.load(path, dtype=np.float32)
+            self.assertEqual(M32.dtype, np.float32)
+            np.testing.assert_allclose(M32.costs_per_discharge(discharges).values, expected.values, rtol=1e-5)
+            path32 = Path(tmpdir) / 'testmodel_4p_float32.qincm'
+            M32.save(path32)
+            del M32
+
+            M = QINCM.load(path32)
+            self.assertEqual(M.dtype, np.float64)
+            np.testing.assert_allclose(M.costs_per_discharge(discharges).values, expected.values, rtol=1e-5)
+            del M
+
+    def test_012_metrics(self):
+        discharges = np.linspace(500, 3000, 26)
+        expected = self.M.costs_for_scenario(discharges)
+
+        # Second metric: same routes in reversed order, values doubled
+        with open(self.route_depth_costs_file) as fin:
+            routes_depth_costs = json.load(fin)
+        routes_depth_double = {r: {d: 2 * c for d, c in dc.items()} for r, dc in reversed(routes_depth_costs.items())}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            double_file = Path(tmpdir) / 'route_depth_double.json'
+            with open(double_file, 'w') as fout:
+                json.dump(routes_depth_double, fout)
+
+            M = QINCM(
+                {'costs': self.route_depth_costs_file, 'double': double_file},
+                self.knelpunt_discharge_depth_file,
+                reference='WA_Nijmegen'
+            )
+
+        a = M.costs_per_discharge(discharges)
+        self.assertEqual(a.columns.names, ['metric', 'route'])
+        pd.testing.assert_frame_equal(a['costs'], self.M.costs_per_discharge(discharges), check_names=False)
+
+        b = M.costs_for_scenario(discharges)
+        np.testing.assert_allclose(b.xs('costs', level='metric').values, expected.values, rtol=1e-12)
+        np.testing.assert_allclose(b.xs('double', level='metric').values, 2 * expected.values, rtol=1e-12)
+        self.assertEqual(list(b.xs('double', level='metric').index), list(expected.index))
+
+    def test_013_stats_resolution(self):
+        discharges = np.linspace(300, 4000, 1000)
+        alltrips_sum, mintrips_sum, mintrips_increase_sum = self.M.stats_knelpunten(discharges=discharges)
+        self.assertEqual(mintrips_sum.shape, (1000, len(self.M.knelpunt_names)))
+
+        # Every route with knelpunten is attributed to exactly one limiting knelpunt
+        costs = self.M.costs_per_discharge(discharges)
+        with_knelpunten = [len(r) > 0 for r in self.M.routes]
+        np.testing.assert_allclose(mintrips_sum.sum(axis=1).values, costs.loc[:, with_knelpunten].sum(axis=1).values)
+
+    def test_014_optimize_measures(self):
+        discharges = np.linspace(500, 3000, 26)
+        candidates = {k: {0.2: 1.0, 0.5: 2.0} for k in self.M.knelpunt_names}
+
+        measures, reduction, cost = self.M.optimize_measures(candidates, budget=3, discharges=discharges)
+        self.assertLessEqual(cost, 3)
+        self.assertGreater(reduction, 0)
+
+        # Same reduction as changing the discharge-depth relations and rerunning the scenario
+        with open(self.knelpunt_discharge_depth_file) as fin:
+            discharge_depth = json.load(fin)
+        discharge_depth_dh = {n: {q: d + measures.get(n, 0) for q, d in QD.items()} for n, QD in discharge_depth.items()}
+        M = QINCM(self.route_depth_costs_file, discharge_depth_dh, reference='WA_Nijmegen')
+        expected = self.M.costs_for_scenario(discharges).sum() - M.costs_for_scenario(discharges).sum()
+        self.assertAlmostEqual(reduction / expected, 1, 9)
+
+        # A wide beam finds the optimum of all combinations within the budget
+        _, reduction_beam, cost_beam = self.M.optimize_measures(candidates, budget=3, discharges=discharges,
+                                                                method='beam', beam_width=1000)
+        self.assertLessEqual(cost_beam, 3)
+        self.assertGreaterEqual(reduction_beam, reduction - 1e-6)
+
+    def test_015_update_knelpunt(self):
+        discharges = np.linspace(500, 3000, 26)
+        M_last = QINCM(self.route_depth_costs_file, self.knelpunt_discharge_depth_file, reference='WA_Nijmegen',
+                       keep_last=True)
+        M_last.costs_per_discharge(discharges)
+
+        with open(self.knelpunt_discharge_depth_file) as fin:
+            discharge_depth = json.load(fin)
+        discharge_depth_original = discharge_depth['IJ_Velp']
+        relation = {q: d + 0.5 for q, d in discharge_depth_original.items()}
+        a = M_last.update_knelpunt('IJ_Velp', relation)
+
+        # Without keep_last nothing is kept, the relation is changed all the same
+        self.M.costs_per_discharge(discharges)
+        self.assertIsNone(self.M._last_evaluation)
+        self.assertIsNone(self.M.update_knelpunt('IJ_Velp', relation))
+
+        discharge_depth['IJ_Velp'] = relation
+        M = QINCM(self.route_depth_costs_file, discharge_depth, reference='WA_Nijmegen')
+        b = M.costs_per_discharge(discharges)
+        np.testing.assert_array_equal(a.values, b.values)
+        np.testing.assert_array_equal(M_last.costs_per_discharge(discharges).values, b.values)
+        np.testing.assert_array_equal(M_last.costs_per_discharge(discharges[::2]).values, b.values[::2])
+        np.testing.assert_array_equal(self.M.costs_per_discharge(discharges).values, b.values)
+        self.assertEqual(M_last.fingerprint, M.fingerprint)
+
+        # Results are not shared with the kept evaluation
+        c = M_last.costs_per_discharge(discharges)
+        c.iloc[:, :] = 0
+        a.iloc[:, :] = 0
+        np.testing.assert_array_equal(M_last.costs_per_discharge(discharges).values, b.values)
+        c = M_last.costs_per_discharge(discharges)
+        M_last.update_knelpunt('IJ_Velp', discharge_depth_original)
+        np.testing.assert_array_equal(c.values, b.values)
+        self.assertEqual(self.M.fingerprint, M.fingerprint)
+
+    def test_016_costs_for_distribution(self):
+        p = np.linspace(0, 1, 11)
+        cdf = pd.DataFrame({'T1': np.linspace(400, 3500, 11), 'T100': np.linspace(300, 1800, 11) ** 1.1}, index=p[::-1])
+
+        a = self.M.costs_for_distribution(cdf)
+        self.assertEqual(a.shape, (len(self.M.routes), 2))
+        np.testing.assert_array_equal(self.M.costs_for_distribution(cdf['T1']).values, a['T1'].values)
+
+        # Same as a (very) dense trapezoidal integration
+        for T in cdf:
+            p_dense = np.linspace(0, 1, 100001)
+            Q_dense = np.interp(p_dense, p, cdf[T].values[::-1])
+            weight = np.full(len(p_dense), 365 * (p_dense[1] - p_dense[0]))
+            weight[[0, -1]] /= 2
+            b = self.M.costs_for_scenario(Q_dense, weight)
+            np.testing.assert_allclose(a[T].values, b.values, rtol=1e-6, atol=1e-3)
+
+    def test_017_costs_ensemble(self):
+        discharges = np.linspace(500, 3000, 26)
+        expected = self.M.costs_for_scenario(discharges)
+
+        # Without uncertainty every member equals the scenario
+        per_route, total = self.M.costs_ensemble(discharges, n=5, depth_std=0.0, seed=1)
+        np.testing.assert_allclose(per_route[50].values, expected.values, rtol=1e-12)
+        self.assertAlmostEqual(total[50] / expected.sum(), 1, 12)
+
+        # Seeded, and independent of the chunk size
+        a, total_a = self.M.costs_ensemble(discharges, n=50, correlation=0.5, cost_std=0.1, seed=2)
+        b, total_b = self.M.costs_ensemble(discharges, n=50, correlation=0.5, cost_std=0.1, seed=2, chunksize=7)
+        pd.testing.assert_frame_equal(a, b)
+        self.assertLess(total_a[5], total_a[50])
+        self.assertLess(total_a[50], total_a[95])
+
+    def test_018_synthetic(self):
+        from qincm.synthetic import write_synthetic_network, synthetic_discharges
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = write_synthetic_network(tmpdir, n_knelpunten=20, n_routes=200, seed=1)
+            M = QINCM(*files, reference='K00000')
+        self.assertEqual(len(M.routes), 200)
+        self.assertEqual(len(M.knelpunt_names), 20)
+
+        discharges = synthetic_discharges(n_days=1000, seed=1)
+        self.assertEqual(len(discharges), 1000)
+        self.assertEqual(len(synthetic_discharges(n_days=200000)), 200000)  # beyond the range of timestamps
+        costs = M.costs_per_discharge(np.sort(discharges.values))
+        self.assertTrue(np.all(np.diff(costs.sum(axis=1).values) <= 1e-6))
+
+    def test_019_profile(self):
+        from qincm.profile import Profiler
+
+        events = []
+        profiler = Profiler(memory=False, hooks=[lambda *args: events.append(args)])
+        M = QINCM(self.route_depth_costs_file, self.knelpunt_discharge_depth_file, reference='WA_Nijmegen',
+                  profile=profiler)
+        self.assertEqual(set(M.last_profile['stages']), {'read', 'read_routes', 'read_knelpunten'})
+
+        discharges = np.linspace(500, 3000, 26)
+        M.costs_for_scenario(discharges)
+        stages = M.last_profile['stages']
+        self.assertEqual(set(stages), {'costs_for_scenario', 'costs_per_discharge', 'local_discharge', 'depth', 'routes'})
+        self.assertAlmostEqual(M.last_profile['total_time'], stages['costs_for_scenario']['time'])
+        self.assertIsNone(M.last_profile['peak_memory'])
+
+        # Totals over all calls, and hooks for every stage
+        self.assertEqual(profiler.report()['stages']['read']['calls'], 1)
+        self.assertEqual(len(events), 8)
+
+        # Same results as without profiling
+        pd.testing.assert_series_equal(M.costs_for_scenario(discharges), self.M.costs_for_scenario(discharges))
+
+        # Peak memory per stage, also without tracemalloc.reset_peak() (Python < 3.9)
+        import qincm.profile
+        reset_peak = qincm.profile._reset_peak
+        try:
+            for qincm.profile._reset_peak in [reset_peak, None]:
+                profiler = Profiler()
+                with profiler.stage('outer'):
+                    with profiler.stage('inner'):
+                        a = np.ones(10 ** 6)
+                    del a
+                    with profiler.stage('small'):
+                        np.ones(10 ** 3)
+                stages = profiler.report()['stages']
+                self.assertGreaterEqual(stages['inner']['peak_memory'], 8 * 10 ** 6)
+                self.assertGreaterEqual(stages['outer']['peak_memory'], 8 * 10 ** 6)
+                self.assertLess(stages['small']['peak_memory'], 10 ** 6)
+        finally:
+            qincm.profile._reset_peak = reset_peak
+
+    def test_020_float32(self):
+        from qincm.validation import compare_precision
+
+        M = QINCM(self.route_depth_costs_file, self.knelpunt_discharge_depth_file, reference='WA_Nijmegen',
+                  dtype=np.float32)
+        discharges = np.linspace(500, 3000, 26)
+        self.assertEqual(M.costs_per_discharge(discharges).values.dtype, np.float32)
+
+        deviation = compare_precision(self.M, M, discharges)
+        self.assertLess(deviation['costs_per_discharge'], 1e-5)
+        self.assertLess(deviation['total_per_route'], 1e-4)
+        self.assertEqual(deviation['memory'], 0.5)
+
+        # Totals are float64
+        totals = M.costs_ensemble(discharges, n=3, depth_std=0.0)[0]
+        self.assertEqual(totals.values.dtype, np.float64)
+        np.testing.assert_allclose(totals[50].values, self.M.costs_for_scenario(discharges).values, rtol=1e-4)
+
+    def test_021_prune_routes(self):
+        discharges = np.linspace(500, 3000, 26)
+        M = QINCM(self.route_depth_costs_file, self.knelpunt_discharge_depth_file, reference='WA_Nijmegen',
+                  prune=(500, 3000))
+
+        # BR_Duitsland (always 9 m deep) is only limiting on its own
+        self.assertEqual([r for r in M.routes if 'BR_Duitsland' in r], [frozenset({'BR_Duitsland'})])
+        self.assertLess(M.pruning.loc['routes', 'after'], M.pruning.loc['routes', 'before'])
+        self.assertEqual(M.pruning.loc['routes', 'after'], len(M.routes))
+
+        # Same costs in total
+        np.testing.assert_allclose(M.costs_per_discharge(discharges).sum(axis=1).values,
+                                   self.M.costs_per_discharge(discharges).sum(axis=1).values, rtol=1e-12)
+        self.assertAlmostEqual(M.costs_for_scenario(discharges).sum() / self.M.costs_for_scenario(discharges).sum(), 1, 12)
+
+        # Only valid in the range it was pruned for
+        with self.assertRaises(AssertionError):
+            M.costs_per_discharge([400, 1000])
+        with self.assertRaises(AssertionError):
+            M.depth_sensitivity([0.1], discharges=discharges)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            M.save(Path(tmpdir) / 'model')
+            self.assertEqual(QINCM.load(Path(tmpdir) / 'model').pruned, [500, 3000])
+
+    @unittest.skipIf(xr is None, 'requires xarray')
+    def test_022_xarray(self):
+        np.random.seed(22)
+        discharges = xr.DataArray(np.random.uniform(500, 3000, (40, 3, 2)), dims=('time', 'member', 'scenario'))
+        discharges[5, 1, 0] = np.nan
+
+        costs = self.M.costs_per_discharge(discharges)
+        self.assertEqual(costs.dims, ('time', 'member', 'scenario', 'route'))
+        expected = self.M.costs_per_discharge(discharges.values[:, 2, 1])
+        np.testing.assert_array_equal(costs.isel(member=2, scenario=1).values, expected.values)
+        self.assertTrue(costs.isel(time=5, member=1, scenario=0).isnull().all())
+
+        # Local discharges per knelpunt, in any order
+        Q_local = self.M._compute_local_discharge(discharges.values[:, 0, 0])
+        local = xr.DataArray(Q_local.values, dims=('time', 'knelpunt'), coords={'knelpunt': list(Q_local.columns)})
+        costs_local = self.M.costs_per_discharge(local.isel(knelpunt=[3, 1, 2, 0]))
+        np.testing.assert_array_equal(costs_local.values, costs.isel(member=0, scenario=0).values)
+
+        # Chunked input gives a lazy result that is written chunk by chunk
+        if dask is None:
+            return
+        lazy = self.M.costs_per_discharge(discharges.chunk({'time': 15}))
+        self.assertIsNotNone(lazy.chunks)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lazy.to_netcdf(Path(tmpdir) / 'costs.nc')
+            with xr.open_dataarray(Path(tmpdir) / 'costs.nc') as written:
+                np.testing.assert_array_equal(written.values, costs.values)
+
+    @unittest.skipIf(pa is None, 'pyarrow is not installed')
+    def test_023_arrow_output(self):
+        from qincm.output import write_costs
+
+        discharges = np.linspace(500, 3000, 26)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            M = QINCM(
+                {'costs': self.route_depth_costs_file, 'double': self.route_depth_costs_file},
+                self.knelpunt_discharge_depth_file,
+                reference='WA_Nijmegen'
+            )
+            write_costs(M, Path(tmpdir) / 'costs.arrow', discharges, per_discharge=True, chunksize=10)
+            with pa.memory_map(str(Path(tmpdir) / 'costs.arrow')) as source:
+                table = pa.ipc.open_file(source).read_all().to_pandas()
+
+            with self.assertRaises(ValueError):
+                write_costs(M, Path(tmpdir) / 'costs.csv', discharges)
+            with self.assertRaises(ValueError):
+                write_costs(M, Path(tmpdir) / 'local.arrow', M._compute_local_discharge(discharges), per_discharge=True)
+            self.assertFalse((Path(tmpdir) / 'local.arrow').exists())
+
+        self.assertEqual(len(table), 26 * 2 * len(self.M.routes))
+        self.assertEqual(list(table['metric'].cat.categories), ['costs', 'double'])
+
+        # Rows in the order of costs_per_discharge, routes by their knelpunten
+        expected = (M.costs_per_discharge(discharges) - M.costs_no_problems).values.ravel()
+        np.testing.assert_array_equal(table['costs'].values, expected)
+        route = self.M.route_index.labels()[3]
+        self.assertEqual(frozenset(table['route'][3]), route)
+
+    @unittest.skipIf(numba is None, 'numba is not installed')
+    def test_024_fused_kernel(self):
+        np.random.seed(24)
+        discharges = np.random.uniform(400, 3500, 500)
+        discharges[7] = np.nan
+        occurance = np.random.uniform(0, 2, 500)
+        Q_local = self.M._compute_local_discharge(discharges)
+        M32 = QINCM(self.route_depth_costs_file, self.knelpunt_discharge_depth_file, reference='WA_Nijmegen',
+                    dtype=np.float32)
+        M_metrics = QINCM(
+            {'costs': self.route_depth_costs_file, 'double': self.route_depth_costs_file},
+            self.knelpunt_discharge_depth_file,
+            reference='WA_Nijmegen'
+        )
+
+        for M, rtol in [(self.M, 1e-12), (M32, 1e-6), (M_metrics, 1e-12)]:
+            M.fused_min_size = 0
+            for args in [(discharges,), (discharges, occurance), (discharges, 2.0, False),
+                         (Q_local.iloc[:, ::-1], occurance)]:
+                fused = M.costs_for_scenario(*args)
+                M.fused = False
+                expected = M.costs_for_scenario(*args)
+                M.fused = True
+                pd.testing.assert_index_equal(fused.index, expected.index)
+                np.testing.assert_allclose(fused.values, expected.values, rtol=rtol, atol=1e-6)
+
+        # The kernel is a stage of its own when profiling, and only used for large scenarios
+        M = QINCM(self.route_depth_costs_file, self.knelpunt_discharge_depth_file, reference='WA_Nijmegen', profile=True)
+        M.costs_for_scenario(discharges)
+        self.assertNotIn('fused', M.last_profile['stages'])
+        M.fused_min_size = 0
+        M.costs_for_scenario(discharges)
+        self.assertEqual(set(M.last_profile['stages']), {'costs_for_scenario', 'fused'})
+
+        # Not used when the last evaluation is kept for update_knelpunt()
+        M = QINCM(self.route_depth_costs_file, self.knelpunt_discharge_depth_file, reference='WA_Nijmegen',
+                  profile=True, keep_last=True)
+        M.fused_min_size = 0
+        M.costs_for_scenario(discharges)
+        self.assertNotIn('fused', M.last_profile['stages'])
+        self.assertIsNotNone(M.update_knelpunt('IJ_Velp', {500: 2.0, 3000: 4.0}))
+
+    def test_025_workers(self):
+        from qincm.synthetic import write_synthetic_network
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = write_synthetic_network(tmpdir, n_knelpunten=20, n_routes=1000, seed=25)
+            M = QINCM(*files, reference='K00000')
+        np.random.seed(25)
+        discharges = np.random.uniform(500, 9000, 400)
+        occurance = np.random.uniform(0, 2, 400)
+
+        # Identical results for any number of workers
+        M.fused_min_size = 0
+        for fused in [False, True]:
+            M.fused = fused
+            expected = M.costs_for_scenario(discharges, occurance)
+            for workers in [2, 3, -1]:
+                np.testing.assert_array_equal(M.costs_for_scenario(discharges, occurance, workers=workers).values,
+                                              expected.values)
+
+        expected = M.costs_per_discharge(discharges)
+        np.testing.assert_array_equal(M.costs_per_discharge(discharges, workers=3).values, expected.values)
+
+        expected = M.stats_knelpunten(discharges=discharges)
+        for a, b in zip(M.stats_knelpunten(discharges=discharges, workers=3), expected):
+            pd.testing.assert_frame_equal(a, b, check_exact=True)
+
+    def test_026_inverse_queries(self):
+        # Discharge below which each route costs more than the target per day
+        target = 5000.0
+        thresholds = self.M.discharge_thresholds(target, 500, 3000)
+        self.assertEqual(list(thresholds.index), list(self.M.routes))
+        inside = thresholds[(thresholds > 500) & (thresholds < 3000)]
+        self.assertGreater(len(inside), 0)
+        costs = self.M.costs_per_discharge(inside.values) - self.M.costs_no_problems
+        np.testing.assert_allclose(np.diag(costs[inside.index].values), target, rtol=1e-9)
+        costs = self.M.costs_per_discharge(np.linspace(500, 3000, 251)) - self.M.costs_no_problems
+        never = thresholds.index[thresholds.isnull()]
+        self.assertTrue((costs[never] < target).all().all())
+
+        # Deepening per knelpunt for a saving, checked with the forward model
+        discharges = np.linspace(500, 3000, 26)
+        deepening = self.M.required_deepening(1e6, discharges=discharges)
+        self.assertEqual(list(deepening.index), self.M.knelpunt_names)
+        reached = deepening.dropna()
+        self.assertGreater(len(reached), 0)
+        self.assertTrue((deepening['max_saving'][deepening['dh'].isnull()] < 1e6).all())
+
+        base = self.M.costs_for_scenario(discharges).sum()
+        sensitivity = self.M.depth_sensitivity(reached['dh'].values, knelpunten=list(reached.index), discharges=discharges)
+        for k, dh in reached['dh'].items():
+            saving = base - sensitivity.xs((dh, k), level=['dh', 'knelpunt']).sum()
+            self.assertAlmostEqual(saving, 1e6, places=3)
+